@@ -1,8 +1,48 @@
 __version__ = "0.0.1"
 __author__ = 'X Liu'
 
-from .reference import JRAGroundCondition
-from .const import RaceLocation
-from .schedule import JRASchedule
-from .shutsuba import NKBJRAShutsuba
-from .result import NKBResult
\ No newline at end of file
+import importlib
+
+# Public classes are imported on first access so that `import abt` stays cheap
+# and using one loader only pays for the modules that loader needs
+_exports = {
+    'JRAGroundCondition': '.reference',
+    'JRAGroundConditions': '.reference',
+    'RaceLocation': '.const',
+    'URLKind': '.const',
+    'JRASchedule': '.schedule',
+    'NKBJRAShutsuba': '.shutsuba',
+    'NKBJRAShutsubaBatch': '.shutsuba',
+    'stream_odds': '.shutsuba',
+    'NKBResult': '.result',
+    'Transport': '.transport',
+    'HTTPTransport': '.transport',
+    'default_transport': '.transport',
+    'set_default_transport': '.transport',
+    'ResponseCache': '.cache',
+    'CachedTransport': '.cache',
+    'ParquetArchive': '.archive',
+    'NKBResultBackfill': '.backfill',
+    'Pipeline': '.pipeline',
+    'load_shutsuba': '.pipeline',
+    'load_results': '.pipeline',
+    'load_schedule': '.pipeline',
+    'PayoutTable': '.payout',
+    'register_ticket_type': '.payout',
+    'RaceScheduler': '.scheduler',
+    'EntityStore': '.entity',
+    'ArrowPublisher': '.export',
+    'ArrowReader': '.export',
+}
+
+__all__ = list(_exports)
+
+def __getattr__(name:str):
+    if name not in _exports:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(importlib.import_module(_exports[name], __name__), name)
+    globals()[name] = value
+    return value
+
+def __dir__():
+    return sorted(list(globals()) + __all__)
@@ -0,0 +1,91 @@
+import os
+import uuid
+import pandas as pd
+
+from abc import ABC, abstractmethod
+
+try:
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+
+class Archive(ABC):
+
+    @abstractmethod
+    def append(self, table:str, data:pd.DataFrame):
+      pass
+
+    @abstractmethod
+    def read(self, table:str, columns:list[str]|None = None, filters=None) -> pd.DataFrame:
+      pass
+
+# Parquet dataset per table under root, hive partitioned (date=2023-11-26/location=東京/...)
+# read pushes filters down to partitions and row groups and only loads the requested columns
+# Example:
+#   archive = ParquetArchive('~/abt-archive')
+#   archive.append('shutsuba', NKBJRAShutsubaBatch(schedule.data()).data())
+#   archive.read('shutsuba', columns=['horseId', 'odds'],
+#                filters=[('location', '==', '東京'), ('date', '>=', datetime.date(2023, 1, 1))])
+class ParquetArchive(Archive):
+
+    # partition columns per table, tables not listed use default_partitions
+    partitions:dict[str, list[str]] = {
+        'schedule': ['date', 'location'],
+        'shutsuba': ['date', 'location'],
+        'odds': ['date', 'location'],
+        # netkeiba result pages are addressed by race id, which carries the year but not the date
+        'result': ['year', 'location'],
+        'ranking': ['year', 'location'],
+    }
+    default_partitions = ['date', 'location']
+    partition_types = {
+        'date': 'date32',
+        'year': 'int16',
+        'location': 'string',
+    }
+
+    def __init__(self, root:str) -> None:
+        if pa is None:
+            raise ImportError('pyarrow is required for ParquetArchive')
+        self.root = os.path.expanduser(root)
+
+    def path(self, table:str) -> str:
+        return os.path.join(self.root, table)
+
+    def tables(self) -> list[str]:
+        if not os.path.isdir(self.root):
+            return list()
+        return sorted(x for x in os.listdir(self.root) if os.path.isdir(self.path(x)))
+
+    def __partitioning(self, table:str):
+        cols = self.partitions.get(table, self.default_partitions)
+        fields = [(x, getattr(pa, self.partition_types.get(x, 'string'))()) for x in cols]
+        return ds.partitioning(pa.schema(fields), flavor='hive')
+
+    def append(self, table:str, data:pd.DataFrame):
+        partitioning = self.__partitioning(table)
+        missing = [x for x in partitioning.schema.names if x not in data.columns]
+        if missing:
+            raise ValueError(f'{table} data has no partition columns {missing}')
+        data = data.copy()
+        if 'date' in partitioning.schema.names:
+            data['date'] = pd.to_datetime(data['date']).dt.date
+        arrow = pa.Table.from_pandas(data, preserve_index=False)
+        ds.write_dataset(
+            arrow,
+            self.path(table),
+            format='parquet',
+            partitioning=partitioning,
+            basename_template=f'part-{uuid.uuid4().hex}-{{i}}.parquet',
+            existing_data_behavior='overwrite_or_ignore')
+
+    # filters: pyarrow expression or pandas style list of (column, op, value) tuples
+    def read(self, table:str, columns:list[str]|None = None, filters=None) -> pd.DataFrame:
+        if not os.path.isdir(self.path(table)):
+            raise FileNotFoundError(f'No table {table} in {self.root}')
+        if isinstance(filters, list):
+            filters = pq.filters_to_expression(filters)
+        dataset = ds.dataset(self.path(table), format='parquet', partitioning=self.__partitioning(table))
+        return dataset.to_table(columns=columns, filter=filters).to_pandas()
@@ -0,0 +1,188 @@
+import argparse
+import datetime
+import json
+import os
+import threading
+import pandas as pd
+
+from . import schema
+from .archive import Archive, ParquetArchive
+from .const import RaceLocation
+from .pool import map_concurrent
+from .result import NKBResult
+from .schedule import build_netkeiba_race_id, build_netkeiba_url
+from .transport import Transport, default_transport
+
+# Backfill netkeiba results into an archive
+#
+# Race ids are generated with the JRASchedule scheme (year, location, 回, 日, race). A race id
+# only carries the year, so the backfill works on whole years: every meeting of the years in
+# [start_year, end_year] is walked. 回 and 日 are probed in order per location and the walk
+# moves on as soon as race 1 of a day has no payouts, races 2..max_race of a day are fetched
+# concurrently.
+# Locations are backfilled concurrently (max_workers), requests are bounded by the transport.
+#
+# Payouts go to the 'result' table and the finishing order to 'ranking'. Race ids already in the
+# archive are not fetched again and (year, location) pairs finished without failed requests and
+# empty ids are kept in a json checkpoint, so a crashed run resumes where it stopped and the
+# races that failed are fetched again.
+class NKBResultBackfill:
+
+    def __init__(self,
+                 archive:Archive,
+                 start_year:int,
+                 end_year:int,
+                 checkpoint:str|None = None,
+                 locations:list[RaceLocation]|None = None,
+                 max_workers:int = 8,
+                 transport:Transport|None = None,
+                 max_round:int = 8,
+                 max_day:int = 12,
+                 max_race:int = 12) -> None:
+        if end_year < start_year:
+            raise ValueError('end_year must not be before start_year')
+        self.archive = archive
+        self.years = list(range(start_year, end_year+1))
+        self.locations = [x.name for x in (locations or list(RaceLocation))]
+        self.checkpoint = checkpoint
+        self.max_workers = max_workers
+        self.transport = transport or default_transport()
+        self.max_round = max_round
+        self.max_day = max_day
+        self.max_race = max_race
+        self._lock = threading.Lock()
+        self._state = self.__load_checkpoint()
+        self._archived = self.__archived()
+        self.errors:dict[str, str] = dict()
+
+    def __load_checkpoint(self) -> dict:
+        if self.checkpoint and os.path.exists(self.checkpoint):
+            with open(self.checkpoint) as f:
+                state = json.load(f)
+            return {'done': set(state['done']), 'empty': set(state['empty'])}
+        return {'done': set(), 'empty': set()}
+
+    def __save_checkpoint(self) -> None:
+        if not self.checkpoint:
+            return
+        os.makedirs(os.path.dirname(os.path.abspath(self.checkpoint)), exist_ok=True)
+        tmp = f'{self.checkpoint}.tmp'
+        with open(tmp, 'w') as f:
+            json.dump({k:sorted(v) for k, v in self._state.items()}, f)
+        os.replace(tmp, self.checkpoint)
+
+    def __archived(self) -> set[str]:
+        try:
+            return set(self.archive.read('result', columns=['raceId'])['raceId'])
+        except FileNotFoundError:
+            return set()
+
+    # races of the current year may still be run, they are not finished or empty for good
+    def __final(self, race_id:str) -> bool:
+        return int(race_id[:4]) < datetime.date.today().year
+
+    # fetched result of a race, None when the race has no payouts or the request failed
+    def __fetch(self, race_id:str) -> NKBResult|None:
+        if race_id in self._state['empty']:
+            return None
+        try:
+            result = NKBResult(build_netkeiba_url(race_id, 'result'), transport=self.transport)
+        except Exception as e:
+            with self._lock:
+                self.errors[race_id] = repr(e)
+            return None
+        if result.soup.find('tr', class_='Tansho') is None:
+            if self.__final(race_id):
+                with self._lock:
+                    self._state['empty'].add(race_id)
+            return None
+        return result
+
+    def __meta(self, race_id:str, location:str) -> dict:
+        return {'raceKey': int(race_id), 'raceId': race_id, 'year': int(race_id[:4]), 'location': location,
+                'round': int(race_id[6:8]), 'day': int(race_id[8:10]), 'race': int(race_id[10:12])}
+
+    def __store(self, location:str, results:dict[str, NKBResult]) -> None:
+        if not results:
+            return
+        payouts = [x.payouts.reset_index(drop=True).assign(**self.__meta(k, location)) for k, x in results.items()]
+        # wide patterns are pairs, store every pattern as a list of '-' joined horse numbers
+        payouts = [x.assign(pattern=x['pattern'].map(
+            lambda p: ['-'.join(y) if isinstance(y, list) else y for y in p])) for x in payouts]
+        rankings = [x.ranking.reset_index(drop=True).assign(**self.__meta(k, location)) for k, x in results.items()]
+        self.archive.append('result', schema.apply(pd.concat(payouts, ignore_index=True), schema.PAYOUT))
+        self.archive.append('ranking', schema.apply(pd.concat(rankings, ignore_index=True), schema.RANKING))
+        with self._lock:
+            self._archived.update(results)
+
+    # walk one day, returns False when the day did not take place
+    def __backfill_day(self, year:int, location:str, round:int, day:int) -> bool:
+        ids = [build_netkeiba_race_id(location, year, round, day, x) for x in range(1, self.max_race+1)]
+        results = dict()
+        if ids[0] not in self._archived:
+            first = self.__fetch(ids[0])
+            if first is not None:
+                results[ids[0]] = first
+            elif ids[0] not in self.errors:
+                return False
+            # a failed request does not tell whether the day was held, fetch the other races
+        todo = [x for x in ids[1:] if x not in self._archived]
+        for race_id, result in zip(todo, map_concurrent(self.__fetch, todo, self.max_race)):
+            if result is not None:
+                results[race_id] = result
+        self.__store(location, results)
+        with self._lock:
+            self.__save_checkpoint()
+        return True
+
+    def __backfill_location(self, key:tuple[int, str]) -> None:
+        year, location = key
+        if f'{year}-{location}' in self._state['done']:
+            return
+        # 回 and 日 are held in order, stop at the first one that did not take place
+        for round in range(1, self.max_round+1):
+            days = 0
+            for day in range(1, self.max_day+1):
+                if not self.__backfill_day(year, location, round, day):
+                    break
+                days += 1
+            if days == 0:
+                break
+        # races whose request failed are fetched again by the next run
+        prefix = build_netkeiba_race_id(location, year, 1, 1, 1)[:6]
+        with self._lock:
+            failed = any(x.startswith(prefix) for x in self.errors)
+        if year < datetime.date.today().year and not failed:
+            with self._lock:
+                self._state['done'].add(f'{year}-{location}')
+                self.__save_checkpoint()
+
+    # finished past years are skipped, the current year is walked again on every run
+    def run(self) -> None:
+        keys = [(year, location) for year in self.years for location in self.locations]
+        map_concurrent(self.__backfill_location, keys, self.max_workers)
+
+def main():
+    parser = argparse.ArgumentParser(description='Backfill netkeiba results into a parquet archive')
+    parser.add_argument('archive', help='archive root directory')
+    # race ids carry no date below the year, see NKBResultBackfill
+    parser.add_argument('--start-year', type=int, required=True)
+    parser.add_argument('--end-year', type=int, default=datetime.date.today().year)
+    parser.add_argument('--checkpoint', default=None, help='defaults to <archive>/backfill.json')
+    parser.add_argument('--location', action='append', choices=[x.name for x in RaceLocation])
+    parser.add_argument('--max-workers', type=int, default=8)
+    args = parser.parse_args()
+
+    backfill = NKBResultBackfill(
+        ParquetArchive(args.archive),
+        args.start_year,
+        args.end_year,
+        checkpoint=args.checkpoint or os.path.join(os.path.expanduser(args.archive), 'backfill.json'),
+        locations=[RaceLocation[x] for x in args.location] if args.location else None,
+        max_workers=args.max_workers)
+    backfill.run()
+    for race_id, error in backfill.errors.items():
+        print(f'{race_id}: {error}')
+
+if __name__ == '__main__':
+    main()
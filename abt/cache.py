@@ -0,0 +1,174 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+import requests
+from requests.structures import CaseInsensitiveDict
+from requests.utils import get_encoding_from_headers
+
+from .const import URLKind
+from .instrument import count
+from .transport import Transport, HTTPTransport, classify_url
+
+# Lifetime in seconds of a cached page per URL kind
+# None: never expires (finished race results do not change)
+# kinds missing from the mapping are not cached
+DEFAULT_TTL:dict[URLKind, float|None] = {
+    URLKind.result: None,
+    URLKind.odds: 10,
+    URLKind.shutuba: 60*60,
+    URLKind.schedule: 6*60*60,
+    URLKind.baba: 5*60,
+    URLKind.profile: 24*60*60,
+}
+
+def default_cache_path() -> str:
+    root = os.environ.get('XDG_CACHE_HOME', os.path.join(os.path.expanduser('~'), '.cache'))
+    return os.path.join(root, 'abt', 'http.sqlite')
+
+# On-disk response store keyed by url, backed by sqlite
+# Entries are evicted least recently used first once the stored bodies exceed max_bytes
+class ResponseCache:
+    def __init__(self, path:str|None = None, max_bytes:int = 512*1024*1024) -> None:
+        self.path = path or default_cache_path()
+        self.max_bytes = max_bytes
+        if self.path != ':memory:':
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        self._conn.execute('''
+            CREATE TABLE IF NOT EXISTS responses (
+                url TEXT PRIMARY KEY,
+                kind TEXT NOT NULL,
+                headers TEXT NOT NULL,
+                content BLOB NOT NULL,
+                size INTEGER NOT NULL,
+                stored_at REAL NOT NULL,
+                accessed_at REAL NOT NULL)''')
+        self._conn.execute('CREATE INDEX IF NOT EXISTS responses_accessed ON responses(accessed_at)')
+        self._conn.commit()
+
+    def get(self, url:str) -> dict|None:
+        with self._lock:
+            row = self._conn.execute(
+                'SELECT kind, headers, content, stored_at FROM responses WHERE url=?', (url,)).fetchone()
+            if row is None:
+                return None
+            self._conn.execute('UPDATE responses SET accessed_at=? WHERE url=?', (time.time(), url))
+            self._conn.commit()
+        return {'url':url, 'kind':URLKind[row[0]], 'headers':json.loads(row[1]),
+                'content':row[2], 'stored_at':row[3]}
+
+    def put(self, url:str, kind:URLKind, headers:dict, content:bytes) -> None:
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                'INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?, ?)',
+                (url, kind.name, json.dumps(dict(headers)), content, len(content), now, now))
+            self.__evict()
+            self._conn.commit()
+
+    # mark a stored entry as fresh again after a 304
+    def touch(self, url:str) -> None:
+        now = time.time()
+        with self._lock:
+            self._conn.execute('UPDATE responses SET stored_at=?, accessed_at=? WHERE url=?', (now, now, url))
+            self._conn.commit()
+
+    def delete(self, url:str) -> None:
+        with self._lock:
+            self._conn.execute('DELETE FROM responses WHERE url=?', (url,))
+            self._conn.commit()
+
+    def clear(self) -> None:
+        with self._lock:
+            self._conn.execute('DELETE FROM responses')
+            self._conn.commit()
+
+    def size(self) -> int:
+        with self._lock:
+            return self._conn.execute('SELECT COALESCE(SUM(size), 0) FROM responses').fetchone()[0]
+
+    def __evict(self) -> None:
+        total = self._conn.execute('SELECT COALESCE(SUM(size), 0) FROM responses').fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        rows = self._conn.execute('SELECT url, size FROM responses ORDER BY accessed_at').fetchall()
+        stale = []
+        for url, size in rows:
+            if total <= self.max_bytes:
+                break
+            stale.append((url,))
+            total -= size
+        self._conn.executemany('DELETE FROM responses WHERE url=?', stale)
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+# Transport that serves GET requests from a ResponseCache
+# Fresh entries are returned without touching the network, stale entries are revalidated
+# with If-None-Match / If-Modified-Since and reused on 304.
+# revalidate=True (or revalidate()) sends the stored validators even when the entry is fresh,
+# for callers that must see changes within the TTL
+class CachedTransport(Transport):
+    def __init__(self,
+                 transport:Transport|None = None,
+                 cache:ResponseCache|None = None,
+                 ttl:dict[URLKind, float|None]|None = None) -> None:
+        self.transport = transport or HTTPTransport()
+        self.cache = cache or ResponseCache()
+        self.ttl = DEFAULT_TTL|(ttl or dict())
+
+    def get(self, url:str, kind:URLKind|None = None, revalidate:bool = False, **kwargs) -> requests.Response:
+        kind = kind or classify_url(url)
+        if kind not in self.ttl:
+            return self.transport.get(url, kind=kind, **kwargs)
+
+        entry = self.cache.get(url)
+        if entry is not None:
+            ttl = self.ttl[kind]
+            if not revalidate and (ttl is None or time.time() - entry['stored_at'] < ttl):
+                count('cache', kind=kind.name, result='hit')
+                return self.__to_response(entry)
+            headers = dict(kwargs.pop('headers', None) or dict())
+            if 'ETag' in entry['headers']:
+                headers['If-None-Match'] = entry['headers']['ETag']
+            if 'Last-Modified' in entry['headers']:
+                headers['If-Modified-Since'] = entry['headers']['Last-Modified']
+            res = self.transport.get(url, kind=kind, headers=headers, **kwargs)
+            if res.status_code == 304:
+                count('cache', kind=kind.name, result='revalidated')
+                self.cache.touch(url)
+                return self.__to_response(entry)
+        else:
+            res = self.transport.get(url, kind=kind, **kwargs)
+        count('cache', kind=kind.name, result='miss')
+
+        if res.status_code == 200:
+            self.cache.put(url, kind, self.__headers(res), res.content)
+        return res
+
+    def post(self, url:str, data:dict|None = None, **kwargs) -> requests.Response:
+        return self.transport.post(url, data=data, **kwargs)
+
+    def invalidate(self, url:str) -> None:
+        self.cache.delete(url)
+
+    def revalidate(self, url:str, kind:URLKind|None = None, **kwargs) -> requests.Response:
+        return self.get(url, kind=kind, revalidate=True, **kwargs)
+
+    # keep only the headers needed to rebuild the response and revalidate it
+    def __headers(self, res:requests.Response) -> dict:
+        keep = ['Content-Type', 'ETag', 'Last-Modified']
+        return {k:res.headers[k] for k in keep if k in res.headers}
+
+    def __to_response(self, entry:dict) -> requests.Response:
+        res = requests.Response()
+        res.url = entry['url']
+        res.status_code = 200
+        res.headers = CaseInsensitiveDict(entry['headers'])
+        res.encoding = get_encoding_from_headers(res.headers)
+        res._content = entry['content']
+        return res
@@ -1,4 +1,7 @@
 from enum import Enum
 
 # Enum Race location
-RaceLocation = Enum('RaceLocation', ["札幌","函館","福島","新潟","東京","中山","中京","京都","阪神","小倉"])
\ No newline at end of file
+RaceLocation = Enum('RaceLocation', ["札幌","函館","福島","新潟","東京","中山","中京","京都","阪神","小倉"])
+
+# Enum URL kind, used to pick cache lifetime and to label requests
+URLKind = Enum('URLKind', ["schedule","shutuba","odds","result","baba","profile","other"])
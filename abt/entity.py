@@ -0,0 +1,129 @@
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+from bs4 import BeautifulSoup
+
+from . import schema
+from .const import URLKind
+from .instrument import count
+from .parser import make_soup
+from .transport import Transport, default_transport
+
+# Horses and trainers interned once per store
+#
+# Race cards repeat the id, name and affiliation of the same horses and trainers on every card.
+# compact() replaces them with integer codes into the store (horseCode, trainerCode) and expand()
+# joins them back. Profile pages on db.netkeiba.com are fetched once per id and kept in a bounded
+# least recently used cache.
+# Example:
+#   store = EntityStore()
+#   cards = store.compact(NKBJRAShutsubaBatch(schedule).data())
+#   store.horses.data()
+#   store.horse_profile(store.horses.data().loc[0, 'horseId'])
+
+# One entity kind, codes are positions in the order entities were first seen
+# the attributes of the first occurrence are kept
+class EntityTable:
+    def __init__(self, key:str, columns:list[str], code:str) -> None:
+        self.key = key
+        self.columns = columns
+        self.code = code
+        self._lock = threading.Lock()
+        self._ids = pd.Index([], dtype=object)
+        self._rows:list[pd.DataFrame] = list()
+        self._data:pd.DataFrame|None = None
+
+    def __len__(self) -> int:
+        return len(self._ids)
+
+    # codes of the entities of every row, new entities are added
+    def intern(self, data:pd.DataFrame) -> np.ndarray:
+        ids = data[self.key].astype(str).to_numpy(dtype=object)
+        with self._lock:
+            codes = self._ids.get_indexer(ids)
+            new = codes < 0
+            if new.any():
+                columns = [self.key]+[x for x in self.columns if x in data.columns]
+                rows = data.loc[new, columns].assign(**{self.key: ids[new]}).drop_duplicates(self.key)
+                self._ids = self._ids.append(pd.Index(rows[self.key]))
+                self._rows.append(rows)
+                self._data = None
+                codes[new] = self._ids.get_indexer(ids[new])
+        return codes.astype(np.int32)
+
+    # code of one id, -1 when unknown
+    def code_of(self, id:str) -> int:
+        return int(self._ids.get_indexer([str(id)])[0])
+
+    # attributes indexed by code
+    def data(self) -> pd.DataFrame:
+        with self._lock:
+            if self._data is None:
+                rows = pd.concat(self._rows, ignore_index=True) if self._rows else pd.DataFrame(columns=[self.key]+self.columns)
+                self._data = schema.apply(rows, schema.SHUTSUBA).rename_axis(self.code)
+                self._rows = [self._data]
+            return self._data
+
+class EntityStore:
+    horse_url = 'https://db.netkeiba.com/horse/{}/'
+    trainer_url = 'https://db.netkeiba.com/trainer/{}/'
+
+    # max_profiles: profile pages kept in memory, least recently used first out
+    def __init__(self,
+                 transport:Transport|None = None,
+                 max_profiles:int = 1024) -> None:
+        self.transport = transport or default_transport()
+        self.max_profiles = max_profiles
+        self.horses = EntityTable('horseId', ['horseName'], 'horseCode')
+        self.trainers = EntityTable('trainId', ['trainerName', 'affiliations'], 'trainerCode')
+        self._lock = threading.Lock()
+        self._profiles:OrderedDict[str, dict] = OrderedDict()
+
+    # race card rows with horseCode and trainerCode instead of the ids, names and affiliations
+    def compact(self, data:pd.DataFrame) -> pd.DataFrame:
+        codes = dict()
+        drop = list()
+        for table in [self.horses, self.trainers]:
+            if table.key in data.columns:
+                codes[table.code] = table.intern(data)
+                drop += [x for x in [table.key]+table.columns if x in data.columns]
+        return data.drop(columns=drop).assign(**codes)
+
+    # compacted rows with the ids, names and affiliations joined back
+    def expand(self, data:pd.DataFrame) -> pd.DataFrame:
+        for table in [self.horses, self.trainers]:
+            if table.code in data.columns:
+                data = data.join(table.data(), on=table.code)
+        return data
+
+    def horse_profile(self, horse_id:str) -> dict:
+        return self.__profile(self.horse_url.format(horse_id))
+
+    def trainer_profile(self, trainer_id:str) -> dict:
+        return self.__profile(self.trainer_url.format(trainer_id))
+
+    def __profile(self, url:str) -> dict:
+        with self._lock:
+            if url in self._profiles:
+                self._profiles.move_to_end(url)
+                count('cache', kind=URLKind.profile.name, result='hit')
+                return self._profiles[url]
+        count('cache', kind=URLKind.profile.name, result='miss')
+        res = self.transport.get(url, kind=URLKind.profile)
+        profile = profile_rows(make_soup(res.content))
+        with self._lock:
+            self._profiles[url] = profile
+            while len(self._profiles) > self.max_profiles:
+                self._profiles.popitem(last=False)
+        return profile
+
+# label -> text of the profile table (生年月日, 調教師, 馬主, 生産者, ...)
+def profile_rows(soup:BeautifulSoup) -> dict:
+    rows = dict()
+    for tag in soup.select('table.db_prof_table tr'):
+        th, td = tag.find('th'), tag.find('td')
+        if th is not None and td is not None:
+            rows[th.get_text(strip=True)] = td.get_text(strip=True)
+    return rows
@@ -0,0 +1,129 @@
+import os
+import re
+import tempfile
+import time
+
+import pandas as pd
+
+try:
+    import pyarrow as pa
+    import pyarrow.ipc
+except ImportError:
+    pa = None
+
+# Arrow export of loader outputs for other local processes
+#
+# ArrowPublisher writes every snapshot of a table as an Arrow IPC file under root/<table>/ and
+# then points root/<table>/LATEST at it. Files are written to a temporary name and renamed,
+# so readers never see a partial snapshot. ArrowReader memory maps the latest file, the columns
+# of the returned table are views of the mapped pages: nothing is deserialized or copied, however
+# many readers map the same snapshot. The default root is on /dev/shm, i.e. shared memory.
+# Example:
+#   publisher = ArrowPublisher()
+#   for update in RaceScheduler(schedule).run():
+#       if update.kind == 'odds' and update.data is not None:
+#           publisher.publish(f'odds-{update.key}', update.data)
+#
+#   # in a model worker
+#   reader = ArrowReader()
+#   odds = reader.read('odds-202305050811')     # pyarrow.Table
+#   odds = reader.poll('odds-202305050811')     # None until a newer snapshot is published
+
+def default_export_root() -> str:
+    shm = '/dev/shm'
+    root = shm if os.path.isdir(shm) and os.access(shm, os.W_OK) else tempfile.gettempdir()
+    return os.path.join(root, 'abt')
+
+def _check_table(table:str) -> str:
+    if not re.fullmatch(r'[\w.\-]+', table):
+        raise ValueError(f'Invalid table name {table}, use letters, digits, _, - and .')
+    return table
+
+class ArrowPublisher:
+    # keep: snapshots kept per table, older files are removed (readers that mapped them keep their view)
+    def __init__(self, root:str|None = None, keep:int = 3) -> None:
+        if pa is None:
+            raise ImportError('pyarrow is required for ArrowPublisher')
+        if keep < 1:
+            raise ValueError('keep must be at least 1')
+        self.root = os.path.expanduser(root or default_export_root())
+        self.keep = keep
+
+    def path(self, table:str) -> str:
+        return os.path.join(self.root, _check_table(table))
+
+    # data: DataFrame (a named index such as raceKey is kept as a column) or pyarrow Table
+    # return: path of the snapshot file
+    def publish(self, table:str, data:'pd.DataFrame|pa.Table') -> str:
+        directory = self.path(table)
+        os.makedirs(directory, exist_ok=True)
+        arrow = data if isinstance(data, pa.Table) else pa.Table.from_pandas(data)
+        name = f'{time.time_ns():020d}.arrow'
+        tmp = os.path.join(directory, f'.{name}.tmp')
+        with pa.OSFile(tmp, 'wb') as sink:
+            with pa.ipc.new_file(sink, arrow.schema) as writer:
+                writer.write_table(arrow)
+        os.replace(tmp, os.path.join(directory, name))
+        self.__point(directory, name)
+        self.__prune(directory)
+        return os.path.join(directory, name)
+
+    def tables(self) -> list[str]:
+        if not os.path.isdir(self.root):
+            return list()
+        return sorted(x for x in os.listdir(self.root) if os.path.exists(os.path.join(self.root, x, 'LATEST')))
+
+    def __point(self, directory:str, name:str) -> None:
+        tmp = os.path.join(directory, f'.LATEST.{os.getpid()}.tmp')
+        with open(tmp, 'w') as f:
+            f.write(name)
+        os.replace(tmp, os.path.join(directory, 'LATEST'))
+
+    def __prune(self, directory:str) -> None:
+        snapshots = sorted(x for x in os.listdir(directory) if x.endswith('.arrow'))
+        for name in snapshots[:-self.keep]:
+            try:
+                os.remove(os.path.join(directory, name))
+            except FileNotFoundError:
+                pass
+
+class ArrowReader:
+    def __init__(self, root:str|None = None) -> None:
+        if pa is None:
+            raise ImportError('pyarrow is required for ArrowReader')
+        self.root = os.path.expanduser(root or default_export_root())
+        self._versions:dict[str, str] = dict()
+
+    # name of the latest snapshot, None when nothing was published
+    def version(self, table:str) -> str|None:
+        try:
+            with open(os.path.join(self.root, _check_table(table), 'LATEST')) as f:
+                return f.read().strip() or None
+        except FileNotFoundError:
+            return None
+
+    # memory mapped latest snapshot
+    def read(self, table:str) -> 'pa.Table':
+        # the snapshot may be pruned between reading LATEST and opening it, read LATEST again
+        for _ in range(3):
+            version = self.version(table)
+            if version is None:
+                raise FileNotFoundError(f'No table {table} in {self.root}')
+            try:
+                source = pa.memory_map(os.path.join(self.root, table, version), 'r')
+            except FileNotFoundError:
+                continue
+            self._versions[table] = version
+            return pa.ipc.open_file(source).read_all()
+        raise FileNotFoundError(f'Snapshots of {table} are replaced faster than they can be opened')
+
+    # latest snapshot when it is newer than the one last read by this reader, else None
+    def poll(self, table:str) -> 'pa.Table|None':
+        version = self.version(table)
+        if version is None or version == self._versions.get(table):
+            return None
+        return self.read(table)
+
+    # convenience copy into pandas
+    def read_pandas(self, table:str) -> pd.DataFrame:
+        return self.read(table).to_pandas()
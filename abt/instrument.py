@@ -0,0 +1,153 @@
+import functools
+import json
+import logging
+import threading
+import time
+from typing import Callable, NamedTuple
+
+# Timing spans and counters emitted by the loaders
+#
+#   fetch  one HTTP request         labels: kind, method, host, status   fields: bytes
+#   cache  one cached GET           labels: kind, result (hit/revalidated/miss), CachedTransport and EntityStore profiles
+#   parse  one parse stage          labels: stage (soup, horses, odds, meta, payouts, ...)  fields: rows
+#   build  one DataFrame assembly   labels: table   fields: rows
+#
+# Nothing is recorded until a sink is added, span() then returns a shared no-op object.
+# Example:
+#   prometheus = PrometheusSink()
+#   add_sink(prometheus)
+#   JRASchedule()
+#   print(prometheus.render())
+
+class Event(NamedTuple):
+    type: str          # span or counter
+    name: str
+    value: float       # seconds for spans, increment for counters
+    labels: dict
+    fields: dict
+    time: float
+
+_sinks:list[Callable[[Event], None]] = list()
+
+def add_sink(sink:Callable[[Event], None]) -> None:
+    _sinks.append(sink)
+
+def remove_sink(sink:Callable[[Event], None]) -> None:
+    _sinks.remove(sink)
+
+def enabled() -> bool:
+    return bool(_sinks)
+
+def _emit(event:Event) -> None:
+    for sink in list(_sinks):
+        sink(event)
+
+class _Span:
+    def __init__(self, name:str, labels:dict) -> None:
+        self.name = name
+        self.labels = labels
+        self.fields:dict = dict()
+
+    def label(self, **labels) -> None:
+        self.labels.update(labels)
+
+    def field(self, **fields) -> None:
+        self.fields.update(fields)
+
+    def __enter__(self) -> '_Span':
+        self._started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        if exc_type is not None:
+            self.labels['error'] = exc_type.__name__
+        _emit(Event('span', self.name, time.perf_counter() - self._started, self.labels, self.fields, time.time()))
+
+class _NullSpan:
+    def label(self, **labels) -> None:
+        pass
+
+    def field(self, **fields) -> None:
+        pass
+
+    def __enter__(self) -> '_NullSpan':
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        pass
+
+_null_span = _NullSpan()
+
+def span(name:str, **labels) -> _Span|_NullSpan:
+    if not _sinks:
+        return _null_span
+    return _Span(name, labels)
+
+def count(name:str, value:float = 1, **labels) -> None:
+    if _sinks:
+        _emit(Event('counter', name, value, labels, dict(), time.time()))
+
+# decorator recording a span around every call, DataFrame results add a rows field
+def timed(name:str, **labels):
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not _sinks:
+                return func(*args, **kwargs)
+            with _Span(name, dict(labels)) as s:
+                result = func(*args, **kwargs)
+                if hasattr(result, 'columns'):
+                    s.field(rows=len(result))
+                return result
+        return wrapper
+    return decorator
+
+# one json log line per event
+class LoggingSink:
+    def __init__(self, logger:logging.Logger|None = None, level:int = logging.INFO) -> None:
+        self.logger = logger or logging.getLogger('abt')
+        self.level = level
+
+    def __call__(self, event:Event) -> None:
+        if self.logger.isEnabledFor(self.level):
+            self.logger.log(self.level, json.dumps(event._asdict(), ensure_ascii=False, default=str),
+                            extra={'abt_event': event})
+
+# aggregates events and renders them in the Prometheus text exposition format
+#   spans:    summary abt_<name>_seconds (_sum, _count), span fields as counters abt_<name>_<field>_total
+#   counters: abt_<name>_total
+class PrometheusSink:
+    def __init__(self, prefix:str = 'abt') -> None:
+        self.prefix = prefix
+        self._lock = threading.Lock()
+        # (family, type, sample suffix, labels) -> value
+        self._values:dict[tuple[str, str, str, tuple], float] = dict()
+
+    def __add(self, family:str, mtype:str, suffix:str, labels:dict, value:float) -> None:
+        key = (family, mtype, suffix, tuple(sorted((k, str(v)) for k, v in labels.items())))
+        self._values[key] = self._values.get(key, 0) + value
+
+    def __call__(self, event:Event) -> None:
+        with self._lock:
+            if event.type == 'span':
+                family = f'{self.prefix}_{event.name}_seconds'
+                self.__add(family, 'summary', '_sum', event.labels, event.value)
+                self.__add(family, 'summary', '_count', event.labels, 1)
+                for field, value in event.fields.items():
+                    self.__add(f'{self.prefix}_{event.name}_{field}_total', 'counter', '', event.labels, value)
+            else:
+                self.__add(f'{self.prefix}_{event.name}_total', 'counter', '', event.labels, event.value)
+
+    def render(self) -> str:
+        with self._lock:
+            values = sorted(self._values.items())
+        lines = list()
+        typed = set()
+        for (family, mtype, suffix, labels), value in values:
+            if family not in typed:
+                lines.append(f'# TYPE {family} {mtype}')
+                typed.add(family)
+            text = ','.join('{}="{}"'.format(k, v.replace('\\', '\\\\').replace('"', '\\"')) for k, v in labels)
+            metric = family + suffix
+            lines.append(f'{metric}{{{text}}} {value:g}' if text else f'{metric} {value:g}')
+        return '\n'.join(lines) + '\n'
@@ -0,0 +1,36 @@
+from bs4 import BeautifulSoup, SoupStrainer
+from bs4.builder import builder_registry
+
+from .instrument import span
+
+# HTML parser backend shared by all loaders
+# None keeps the backend each loader passes (lxml), any BeautifulSoup tree builder name overrides it
+# Example: abt.parser.set_backend('html5lib') to parse exactly like older versions of the schedule loader
+_backend:str|None = None
+
+def set_backend(name:str|None) -> None:
+    global _backend
+    if name is not None and builder_registry.lookup(name) is None:
+        raise ValueError(f'Unknown parser backend {name}, is it installed?')
+    _backend = name
+
+def get_backend() -> str|None:
+    return _backend
+
+# Parse content into a soup
+# parse_only restricts the tree to the matching subtrees, loaders pass it when they read only
+# one table or block of the page. html5lib can not build partial trees and parses everything.
+def make_soup(content:bytes|str, features:str = 'lxml', parse_only:SoupStrainer|None = None) -> BeautifulSoup:
+    features = _backend or features
+    if features == 'html5lib':
+        parse_only = None
+    with span('parse', stage='soup', features=features, strained=parse_only is not None):
+        return BeautifulSoup(content, features, parse_only=parse_only)
+
+# subtrees read by the loaders
+RACE_TIME = SoupStrainer(id='syutsuba')
+HORSE_LIST = SoupStrainer(class_=['HorseList', 'RaceData01', 'RaceData02'])
+ODDS_TABLE = SoupStrainer('tbody')
+PAYOUT_ROWS = SoupStrainer('tr', class_=['Tansho', 'Fukusho', 'Wide'])
+RESULT_TABLES = SoupStrainer(['tbody', 'tr'])
+BABA_UNITS = SoupStrainer('div', class_='data_list_unit')
@@ -0,0 +1,226 @@
+import re
+import numpy as np
+import pandas as pd
+from typing import NamedTuple
+
+# Vectorized payout evaluation
+#
+# NKBResult payouts (one row per race and ticket type, pattern/payoff as lists of strings) are
+# normalized once into flat arrays, one entry per race and winning combination:
+#   race    index of the race in PayoutTable.races
+#   ticket  code of the ticket type (TICKET_TYPES)
+#   combo   horse numbers packed into one integer, sorted first for unordered tickets
+#   payoff  yen paid per 100 yen
+# Candidate tickets are packed the same way and looked up with one searchsorted, so scoring a
+# season of tickets is a handful of array operations.
+# Example:
+#   table = PayoutTable.from_results(load_results(schedule)[0])
+#   tickets = pd.DataFrame({'raceKey': ..., 'ticketType': 'wide', 'horse1': 2, 'horse2': 5, 'stake': 100})
+#   per_race, summary = table.evaluate(tickets)
+
+class TicketType(NamedTuple):
+    code: int
+    size: int          # horses in one combination
+    ordered: bool      # True when the order of the horses matters (馬単, 三連単)
+
+TICKET_TYPES:dict[str, TicketType] = dict()
+
+# add a ticket type, names are matched case insensitively against the ticketType column
+def register_ticket_type(name:str, size:int, ordered:bool) -> TicketType:
+    name = name.lower()
+    if not 0 < size <= _max_size:
+        raise ValueError(f'Ticket size must be between 1 and {_max_size}')
+    if name in TICKET_TYPES:
+        raise ValueError(f'Ticket type {name} is already registered')
+    TICKET_TYPES[name] = TicketType(len(TICKET_TYPES), size, ordered)
+    return TICKET_TYPES[name]
+
+# horse numbers are below 32, a combination packs 5 bits per horse
+_bits = 5
+_max_size = 3
+_combo_bits = _max_size*_bits
+
+register_ticket_type('tansho', 1, True)
+register_ticket_type('fukusho', 1, True)
+register_ticket_type('wide', 2, False)
+# not parsed by NKBResult yet, registered so that their rows are scored once they are
+register_ticket_type('umaren', 2, False)
+register_ticket_type('umatan', 2, True)
+register_ticket_type('sanrenpuku', 3, False)
+register_ticket_type('sanrentan', 3, True)
+
+def _ticket_type(name:str) -> TicketType:
+    try:
+        return TICKET_TYPES[str(name).lower()]
+    except KeyError:
+        raise ValueError(f'Unknown ticket type {name}, see register_ticket_type') from None
+
+# payoff text, 1,230円 -> 1230, several payoffs may be joined in one span (310円150円220円)
+def parse_yen(values) -> list[int]:
+    if isinstance(values, str):
+        values = [values]
+    return [int(x.replace(',', '')) for v in values for x in re.findall(r'([\d,]+)円', str(v))]
+
+# combinations of one payout row: [2, 4, 5], [[2, 4], [2, 5]] or archived ['2-4', '2-5']
+def _combinations(pattern) -> list[list[int]]:
+    if isinstance(pattern, str):
+        pattern = [pattern]
+    combos = list()
+    for x in pattern:
+        if isinstance(x, str):
+            combos.append([int(y) for y in re.split(r'[-\s→>]+', x.strip()) if y])
+        elif np.ndim(x):
+            combos.append([int(y) for y in x])
+        else:
+            combos.append([int(x)])
+    return combos
+
+# pack horse numbers (n, size) into one integer per row, horses sorted when the ticket is unordered
+def _pack(horses:np.ndarray, ordered:bool) -> np.ndarray:
+    horses = np.asarray(horses, dtype=np.int64)
+    if not ordered:
+        horses = np.sort(horses, axis=1)
+    shifts = _bits*np.arange(horses.shape[1]-1, -1, -1, dtype=np.int64)
+    return (horses << shifts).sum(axis=1)
+
+def _keys(race:np.ndarray, ticket:np.ndarray, combo:np.ndarray, types:int) -> np.ndarray:
+    return (race.astype(np.int64)*types + ticket) << _combo_bits | combo
+
+class PayoutTable:
+    def __init__(self,
+                 races:pd.Index,
+                 race:np.ndarray,
+                 ticket:np.ndarray,
+                 combo:np.ndarray,
+                 payoff:np.ndarray) -> None:
+        self.races = races
+        self.race = race
+        self.ticket = ticket
+        self.combo = combo
+        self.payoff = payoff
+        # ticket types registered later do not change the keys of this table
+        self._types = len(TICKET_TYPES)
+        keys = _keys(race, ticket, combo, self._types)
+        self._order = np.argsort(keys, kind='stable')
+        self._keys = keys[self._order]
+
+    # results: payout rows of many races, e.g. load_results(...)[0], NKBResult payouts with the race
+    #          key columns assigned, or the backfill result table read from an archive
+    # keys: columns identifying a race, default raceKey (column or index), raceId, or date/location/round/day/race
+    @classmethod
+    def from_results(cls, results:pd.DataFrame, keys:list[str]|None = None) -> 'PayoutTable':
+        keys = keys or _default_keys(results)
+        races = _race_index(results, keys).unique()
+        race_of_row = races.get_indexer(_race_index(results, keys))
+        race, ticket, combo, payoff = list(), list(), list(), list()
+        for i, ticket_type, pattern, yen in zip(race_of_row, results['ticketType'], results['pattern'], results['payoff']):
+            kind = _ticket_type(ticket_type)
+            combos = _combinations(pattern)
+            yen = parse_yen(yen)
+            if len(combos) != len(yen):
+                raise ValueError(f'{ticket_type} of race {races[i]} has {len(combos)} combinations and {len(yen)} payoffs')
+            if any(len(x) != kind.size for x in combos):
+                raise ValueError(f'{ticket_type} of race {races[i]} has combinations of the wrong size')
+            race.extend([i]*len(combos))
+            ticket.extend([kind.code]*len(combos))
+            combo.extend(_pack(np.array(combos).reshape(len(combos), kind.size), kind.ordered) if combos else [])
+            payoff.extend(yen)
+        return cls(races,
+                   np.array(race, dtype=np.int32),
+                   np.array(ticket, dtype=np.int8),
+                   np.array(combo, dtype=np.int64),
+                   np.array(payoff, dtype=np.int32))
+
+    def __len__(self) -> int:
+        return len(self.payoff)
+
+    # payoff per 100 yen of each (race, ticket, combo), 0 for losing tickets
+    def lookup(self, race:np.ndarray, ticket:np.ndarray, combo:np.ndarray) -> np.ndarray:
+        if not len(self._keys):
+            return np.zeros(len(race), dtype=np.int32)
+        keys = _keys(race, ticket, combo, self._types)
+        pos = np.minimum(np.searchsorted(self._keys, keys), len(self._keys)-1)
+        hit = (self._keys[pos] == keys) & (ticket < self._types)
+        return np.where(hit, self.payoff[self._order[pos]], 0)
+
+    # tickets: one row per ticket with the race key columns, ticketType, horse1..horseN (or a pattern
+    #          column of horse numbers) and the stake in yen
+    # return: tickets with payoff (per 100 yen) and return (yen) columns, tickets of races missing from
+    #         the table are not settled and get NaN
+    def score(self, tickets:pd.DataFrame, stake:str = 'stake', keys:list[str]|None = None) -> pd.DataFrame:
+        keys = keys or list(self.races.names)
+        race = self.races.get_indexer(_race_index(tickets, keys))
+        names = tickets['ticketType'].astype(str).str.lower()
+        ticket = np.full(len(tickets), -1, dtype=np.int64)
+        combo = np.zeros(len(tickets), dtype=np.int64)
+        horses = _horses(tickets)
+        for name in names.unique():
+            kind = _ticket_type(name)
+            rows = (names == name).to_numpy()
+            if (horses[rows, kind.size:] > 0).any() or (horses[rows, :kind.size] <= 0).any():
+                raise ValueError(f'{name} tickets need exactly {kind.size} horses')
+            ticket[rows] = kind.code
+            combo[rows] = _pack(horses[rows, :kind.size], kind.ordered)
+        payoff = self.lookup(np.maximum(race, 0), ticket, combo).astype(np.float64)
+        payoff[race < 0] = np.nan
+        stakes = tickets[stake].to_numpy(dtype=np.float64) if stake in tickets.columns else np.full(len(tickets), 100.0)
+        return tickets.assign(payoff=payoff, **{stake: stakes, 'return': payoff*stakes/100})
+
+    # return: (per race stake, return, profit and hits, summary over all races)
+    def evaluate(self, tickets:pd.DataFrame, stake:str = 'stake', keys:list[str]|None = None) -> tuple[pd.DataFrame, pd.Series]:
+        keys = keys or list(self.races.names)
+        scored = self.score(tickets, stake, keys).dropna(subset=['payoff'])
+        scored = scored.assign(hit=scored['payoff'] > 0)
+        per_race = scored.groupby(keys, observed=True, sort=False).agg(
+            stake=(stake, 'sum'), **{'return': ('return', 'sum')}, tickets=('hit', 'size'), hits=('hit', 'sum'))
+        per_race['profit'] = per_race['return'] - per_race['stake']
+        total_stake = per_race['stake'].sum()
+        summary = pd.Series({
+            'races': len(per_race),
+            'tickets': int(per_race['tickets'].sum()),
+            'hits': int(per_race['hits'].sum()),
+            'stake': total_stake,
+            'return': per_race['return'].sum(),
+            'profit': per_race['profit'].sum(),
+            'roi': per_race['return'].sum()/total_stake if total_stake else np.nan,
+            'hitRate': per_race['hits'].sum()/per_race['tickets'].sum() if len(per_race) else np.nan,
+            'raceHitRate': (per_race['hits'] > 0).mean() if len(per_race) else np.nan,
+        })
+        return per_race, summary
+
+def _default_keys(data:pd.DataFrame) -> list[str]:
+    data = _columns(data)
+    for key in ['raceKey', 'raceId']:
+        if key in data.columns:
+            return [key]
+    keys = [x for x in ['date', 'location', 'round', 'day', 'race'] if x in data.columns]
+    if not keys:
+        raise ValueError('No race key columns, pass keys')
+    return keys
+
+# race keys held in the index (load_results) are read like columns
+def _columns(data:pd.DataFrame) -> pd.DataFrame:
+    return data.reset_index() if 'raceKey' in data.index.names else data
+
+def _race_index(data:pd.DataFrame, keys:list[str]) -> pd.Index:
+    data = _columns(data)
+    if len(keys) == 1:
+        return pd.Index(data[keys[0]], name=keys[0])
+    return pd.MultiIndex.from_frame(data[keys])
+
+# horse numbers of every ticket as an (n, 3) array, 0 where a ticket has fewer horses
+def _horses(tickets:pd.DataFrame) -> np.ndarray:
+    size = max(x.size for x in TICKET_TYPES.values())
+    horses = np.zeros((len(tickets), size), dtype=np.int64)
+    cols = [f'horse{i+1}' for i in range(size)]
+    if any(x in tickets.columns for x in cols):
+        for i, col in enumerate(cols):
+            if col in tickets.columns:
+                horses[:, i] = pd.to_numeric(tickets[col]).fillna(0).to_numpy(dtype=np.int64)
+    elif 'pattern' in tickets.columns:
+        for i, pattern in enumerate(tickets['pattern']):
+            combo = _combinations([pattern] if isinstance(pattern, str) else [list(np.atleast_1d(pattern))])[0]
+            horses[i, :len(combo)] = combo
+    else:
+        raise ValueError('Tickets need horse1..horseN or pattern columns')
+    return horses
@@ -0,0 +1,171 @@
+import asyncio
+import os
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Callable, Iterable, NamedTuple
+
+import pandas as pd
+
+from . import racekey, schema
+from .const import URLKind
+from .instrument import span
+from .result import parse_payouts
+from .schedule import parse_round, parse_race_time, with_time, JRASchedule
+from .shutsuba import parse_horses, parse_odds
+from .transport import Transport, default_transport
+
+# Fetch/parse pipeline for large crawls
+#
+#   fetch    fetch_concurrency threads download raw pages through the transport
+#   parse    a process pool turns page bytes into plain row dicts (parse_horses, parse_odds, ...)
+#   assemble rows are tagged with the job key and turned into DataFrames batch_size rows at a time
+#
+# The stages are connected by bounded queues, so a slow stage applies back pressure instead of
+# buffering the whole crawl, and parsing uses every core while the network stays busy.
+
+class Job(NamedTuple):
+    key: dict          # columns added to every row parsed from the page, e.g. date/location/race
+    url: str
+    kind: URLKind
+
+_done = None
+
+class Pipeline:
+    def __init__(self,
+                 parse:Callable[[bytes], list[dict]|dict],
+                 transport:Transport|None = None,
+                 fetch_concurrency:int = 16,
+                 executor:Executor|None = None,
+                 processes:int|None = None,
+                 queue_size:int = 64,
+                 batch_size:int = 1024) -> None:
+        self.parse = parse
+        self.transport = transport or default_transport()
+        self.fetch_concurrency = fetch_concurrency
+        self.executor = executor
+        self.processes = processes or os.cpu_count() or 1
+        self.queue_size = queue_size
+        self.batch_size = batch_size
+        self.errors:list[dict] = list()
+
+    def run(self, jobs:Iterable[Job]) -> pd.DataFrame:
+        return asyncio.run(self.arun(jobs))
+
+    async def arun(self, jobs:Iterable[Job]) -> pd.DataFrame:
+        loop = asyncio.get_running_loop()
+        jobs = iter(jobs)
+        fetched:asyncio.Queue = asyncio.Queue(self.queue_size)
+        parsed:asyncio.Queue = asyncio.Queue(self.queue_size)
+        executor = self.executor or ProcessPoolExecutor(self.processes)
+        threads = ThreadPoolExecutor(self.fetch_concurrency)
+
+        async def fetch():
+            # the job iterator is shared, every worker takes the next job when it is free
+            for job in jobs:
+                try:
+                    res = await loop.run_in_executor(threads, lambda: self.transport.get(job.url, kind=job.kind))
+                except Exception as e:
+                    self.errors.append(job.key|{'url': job.url, 'error': repr(e)})
+                    continue
+                await fetched.put((job, res.content))
+
+        async def parse():
+            while (item := await fetched.get()) is not _done:
+                job, content = item
+                try:
+                    rows = await loop.run_in_executor(executor, self.parse, content)
+                except Exception as e:
+                    self.errors.append(job.key|{'url': job.url, 'error': repr(e)})
+                    continue
+                await parsed.put((job, rows))
+
+        async def assemble() -> list[pd.DataFrame]:
+            frames = list()
+            batch = list()
+            while (item := await parsed.get()) is not _done:
+                job, rows = item
+                batch.extend(job.key|x for x in ([rows] if isinstance(rows, dict) else rows))
+                if len(batch) >= self.batch_size:
+                    with span('build', table='pipeline'):
+                        frames.append(pd.DataFrame(batch))
+                    batch = list()
+            if batch:
+                frames.append(pd.DataFrame(batch))
+            return frames
+
+        async def fetch_stage():
+            await asyncio.gather(*(fetch() for _ in range(self.fetch_concurrency)))
+            for _ in range(self.processes):
+                await fetched.put(_done)
+
+        async def parse_stage():
+            await asyncio.gather(*(parse() for _ in range(self.processes)))
+            await parsed.put(_done)
+
+        try:
+            _, _, frames = await asyncio.gather(fetch_stage(), parse_stage(), assemble())
+        finally:
+            threads.shutdown()
+            if self.executor is None:
+                executor.shutdown()
+        if not frames:
+            return pd.DataFrame()
+        return pd.concat(frames, ignore_index=True)
+
+_race_keys = ['date', 'location', 'round', 'day', 'race']
+
+# races: True tags the rows with the race columns as well as raceKey
+def _jobs(schedule:pd.DataFrame, column:str, kind:URLKind, races:bool = True) -> list[Job]:
+    keys = [x for x in _race_keys if x in schedule.columns] if races else list()
+    return [Job({'raceKey':int(key)}|{k:race[k] for k in keys}, race[column], kind)
+            for key, race in zip(racekey.from_schedule(schedule), schedule.to_dict('records'))]
+
+# Race cards of every race in a schedule (JRASchedule.data()), same frame as NKBJRAShutsubaBatch
+# return: (horses indexed by raceKey and horseNum, errors)
+def load_shutsuba(schedule:pd.DataFrame, processes:int|None = None, **options) -> tuple[pd.DataFrame, pd.DataFrame]:
+    with ProcessPoolExecutor(processes) as executor:
+        horses = Pipeline(parse_horses, executor=executor, **options)
+        odds = Pipeline(parse_odds, executor=executor, **options)
+        horse_rows = horses.run(_jobs(schedule, 'netkeibaURL', URLKind.shutuba))
+        odds_rows = odds.run(_jobs(schedule, 'url', URLKind.odds, races=False))
+    errors = pd.DataFrame(horses.errors + odds.errors)
+    if horse_rows.empty or odds_rows.empty:
+        return pd.DataFrame(), errors
+    with span('build', table='shutsuba_pipeline'):
+        # popularity is the odds rank within each race
+        popularity = odds_rows.groupby('raceKey')['odds'].rank()
+        odds_rows['popularity'] = popularity.astype(int) if popularity.notna().all() else popularity
+        data = pd.merge(horse_rows, odds_rows, on=['raceKey', 'horseNum'])
+        data = schema.apply(data, schema.SHUTSUBA).set_index(['raceKey', 'horseNum'])
+    return data, errors
+
+# Payouts of every race in a schedule, one row per race and ticket type, indexed by raceKey
+def load_results(schedule:pd.DataFrame, processes:int|None = None, **options) -> tuple[pd.DataFrame, pd.DataFrame]:
+    pipeline = Pipeline(parse_payouts, processes=processes, **options)
+    data = schema.apply(pipeline.run(_jobs(schedule, 'resultURL', URLKind.result)), schema.PAYOUT)
+    if not data.empty:
+        data = data.set_index('raceKey')
+    return data, pd.DataFrame(pipeline.errors)
+
+# Schedule rows of the given round pages (JRASchedule.get_location_url(...)['url']) with start times
+# and netkeiba urls, same frame as JRASchedule
+def load_schedule(round_urls:list[str], processes:int|None = None, **options) -> tuple[pd.DataFrame, pd.DataFrame]:
+    with ProcessPoolExecutor(processes) as executor:
+        rounds = Pipeline(parse_round, executor=executor, **options)
+        races = rounds.run(Job(dict(), x, URLKind.schedule) for x in round_urls)
+        if races.empty:
+            return pd.DataFrame(), pd.DataFrame(rounds.errors)
+        times = Pipeline(parse_race_time, executor=executor, **options)
+        start = times.run(Job({'url': x}, x, URLKind.schedule) for x in races['url'])
+    errors = pd.DataFrame(rounds.errors + times.errors)
+    if start.empty:
+        return pd.DataFrame(), errors
+    with span('build', table='schedule_pipeline'):
+        start = start.set_index('url')
+        rows = [with_time(x, start.loc[x['url']].to_dict()) for x in races.to_dict('records') if x['url'] in start.index]
+        data = pd.DataFrame(rows)
+        data.index = pd.Index(racekey.from_frame(data), name='raceKey')
+        schedule = JRASchedule(init=False)
+        data['netkeibaURL'] = schedule.get_netkeiba_shutsuba_url(data)
+        data['resultURL'] = schedule.get_netkeiba_result_url(data)
+        data = schema.apply(data, schema.SCHEDULE)
+    return data.reset_index(), errors
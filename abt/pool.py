@@ -0,0 +1,82 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Iterable, TypeVar
+from urllib.parse import urlparse
+
+T = TypeVar('T')
+R = TypeVar('R')
+
+# Bound the number of in-flight requests per host
+# Example: limiter = HostLimiter(4); with limiter(url): requests.get(url)
+class HostLimiter:
+    def __init__(self, per_host:int = 4) -> None:
+        if per_host < 1:
+            raise ValueError('per_host must be at least 1')
+        self.per_host = per_host
+        self._lock = threading.Lock()
+        self._semaphores:dict[str, threading.BoundedSemaphore] = dict()
+
+    def __call__(self, url:str) -> threading.BoundedSemaphore:
+        host = urlparse(url).netloc
+        with self._lock:
+            if host not in self._semaphores:
+                self._semaphores[host] = threading.BoundedSemaphore(self.per_host)
+            return self._semaphores[host]
+
+# Apply func to every item on a thread pool and return results in input order
+# max_workers <= 1 runs serially on the calling thread
+def map_concurrent(func:Callable[[T], R], items:Iterable[T], max_workers:int = 8) -> list[R]:
+    items = list(items)
+    if max_workers <= 1 or len(items) <= 1:
+        return [func(x) for x in items]
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(items))) as executor:
+        return list(executor.map(func, items))
+
+# Space out requests to the same host so that at most `rate` requests per second are sent
+# rate None disables throttling
+class HostRateLimiter:
+    def __init__(self, rate:float|None = None) -> None:
+        if rate is not None and rate <= 0:
+            raise ValueError('rate must be positive')
+        self.rate = rate
+        self._lock = threading.Lock()
+        self._next:dict[str, float] = dict()
+
+    def wait(self, url:str) -> None:
+        if self.rate is None:
+            return
+        host = urlparse(url).netloc
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next.get(host, now))
+            self._next[host] = slot + 1.0/self.rate
+        if now < slot:
+            time.sleep(slot - now)
+
+# Token bucket shared by every request of a component, at most `rate` requests per second on
+# average with bursts of up to `capacity`
+# take() does not block, it returns how long to wait before the tokens are available
+class TokenBucket:
+    def __init__(self, rate:float, capacity:float = 1, clock:Callable[[], float] = time.monotonic) -> None:
+        if rate <= 0 or capacity <= 0:
+            raise ValueError('rate and capacity must be positive')
+        self.rate = rate
+        self.capacity = capacity
+        self.clock = clock
+        self._lock = threading.Lock()
+        self._tokens = capacity
+        self._last = clock()
+
+    # take n tokens, return: 0 when taken, otherwise seconds until n tokens are available
+    def take(self, n:float = 1) -> float:
+        if n > self.capacity:
+            raise ValueError(f'Can not take {n} tokens from a bucket of {self.capacity}')
+        with self._lock:
+            now = self.clock()
+            self._tokens = min(self.capacity, self._tokens + (now - self._last)*self.rate)
+            self._last = now
+            if self._tokens >= n:
+                self._tokens -= n
+                return 0
+            return (n - self._tokens)/self.rate
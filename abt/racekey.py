@@ -0,0 +1,86 @@
+import numpy as np
+import pandas as pd
+
+from .const import RaceLocation
+
+# Integer race key
+# The netkeiba race id (year, location, 回, 日, race, e.g. 202305050811) read as an int64:
+#   key = year*10**8 + location*10**6 + round*10**4 + day*100 + race
+# Keys sort by year, location, round, day and race, and convert to ids and urls without
+# formatting strings row by row. Every function takes and returns whole columns.
+# Example:
+#   keys = racekey.from_frame(JRASchedule(init=False).get_location_url(...))
+#   racekey.to_url(keys, 'result')
+
+_location_code = {x.name: x.value for x in RaceLocation}
+_location_name = pd.Categorical.from_codes(
+    [x.value-1 for x in RaceLocation], categories=[x.name for x in RaceLocation])
+
+_url = 'https://race.netkeiba.com/race/{}.html?race_id='
+
+def _ints(values) -> np.ndarray:
+    return pd.to_numeric(pd.Series(values).reset_index(drop=True)).to_numpy(dtype=np.int64)
+
+def location_codes(location) -> np.ndarray:
+    # categorical locations are mapped once per category
+    codes = pd.Series(location).reset_index(drop=True).map(_location_code)
+    if codes.isna().any():
+        raise ValueError(f'Unknown race locations {sorted(set(pd.Series(location)[codes.isna().to_numpy()]))}')
+    return codes.to_numpy(dtype=np.int64)
+
+def encode(year, location, round, day, race) -> np.ndarray:
+    return (_ints(year)*10**8 + location_codes(location)*10**6
+            + _ints(round)*10**4 + _ints(day)*100 + _ints(race))
+
+# keys of the rows of a frame with date (or year), location, round, day and race columns
+def from_frame(data:pd.DataFrame) -> np.ndarray:
+    if 'year' in data.columns:
+        year = data['year']
+    elif hasattr(data['date'], 'dt'):
+        # arrow date32 and datetime64 columns
+        year = data['date'].dt.year
+    else:
+        year = pd.to_datetime(data['date']).dt.year
+    return encode(year, data['location'], data['round'], data['day'], data['race'])
+
+# return: year, location, round, day and race of every key
+def decode(keys) -> pd.DataFrame:
+    keys = np.asarray(keys, dtype=np.int64)
+    return pd.DataFrame({
+        'year': (keys // 10**8).astype(np.int16),
+        'location': _location_name.take((keys // 10**6 % 100) - 1),
+        'round': (keys // 10**4 % 100).astype(np.uint8),
+        'day': (keys // 100 % 100).astype(np.uint8),
+        'race': (keys % 100).astype(np.uint8),
+    })
+
+def to_race_id(keys) -> pd.Series:
+    return pd.Series(np.asarray(keys, dtype=np.int64)).astype(str)
+
+def from_race_id(race_ids) -> np.ndarray:
+    return _ints(race_ids)
+
+# mode: shutuba or result
+def to_url(keys, mode:str = 'shutuba') -> pd.Series:
+    return _url.format(mode) + to_race_id(keys)
+
+# keys of netkeiba race urls, -1 where the url has no race id
+def from_url(urls) -> np.ndarray:
+    ids = pd.Series(urls).reset_index(drop=True).astype(str).str.extract(r'race_id=(\d{12})', expand=False)
+    return pd.to_numeric(ids).fillna(-1).to_numpy(dtype=np.int64)
+
+# keys of a schedule frame (JRASchedule.data()): its raceKey column, else the race columns,
+# else the race id in netkeibaURL
+def from_schedule(data:pd.DataFrame) -> np.ndarray:
+    if 'raceKey' in data.columns:
+        return _ints(data['raceKey'])
+    if data.index.name == 'raceKey':
+        return _ints(data.index)
+    if all(x in data.columns for x in ['location', 'round', 'day', 'race']) and \
+            any(x in data.columns for x in ['date', 'year']):
+        return from_frame(data)
+    return from_url(data['netkeibaURL'])
+
+# rows of one race (a single race card, odds table or result) indexed by its key
+def keyed(data:pd.DataFrame, key:int) -> pd.DataFrame:
+    return data.set_axis(pd.Index(np.full(len(data), key, dtype=np.int64), name='raceKey'))
@@ -1,15 +1,17 @@
-from bs4 import BeautifulSoup
 import pandas as pd
 from urllib.parse import urljoin
-import requests
 import re
 import datetime as dt
-import re
+import hashlib
+from bs4 import BeautifulSoup
 
-from enum import Enum
 from abc import ABC, abstractmethod
 
-from .const import RaceLocation
+from .const import RaceLocation, URLKind
+from .instrument import timed
+from .parser import make_soup, BABA_UNITS
+from .pool import map_concurrent
+from .transport import Transport, default_transport
 
 class GroundCondition(ABC):
     @abstractmethod
@@ -26,8 +28,10 @@ class JRAGroundCondition(GroundCondition):
     def __init__(self,
                 location: RaceLocation|str, 
                 init:bool = True, 
-                url:str = 'https://www.jra.go.jp/keiba/baba/'):
+                url:str = 'https://www.jra.go.jp/keiba/baba/',
+                transport:Transport|None = None):
         self.url = url
+        self.transport = transport or default_transport()
         self.location = location.name if isinstance(location, RaceLocation) else location
         self.weather = ''
         self.shiba_condition = ''
@@ -36,6 +40,7 @@ class JRAGroundCondition(GroundCondition):
         if init:
           self.init()
     
+    @timed('build', table='ground_condition')
     def to_df(self):
         return pd.DataFrame({
             'date': [self.date],
@@ -54,9 +59,18 @@ class JRAGroundCondition(GroundCondition):
     
     # Get Race meta info including datetime, weather and ground condition
     def init(self):
-        res = requests.get(self.url)
-        soup = BeautifulSoup(res.content, 'lxml')
-
+        res = self.transport.get(self.url, kind=URLKind.baba)
+        location_url = self.parse_index(make_soup(res.content))
+
+        if self.location not in location_url:
+            raise RuntimeError(f'No ground condition page for {self.location}')
+        res = self.transport.get(location_url[self.location], kind=URLKind.baba)
+        self.parse_location(make_soup(res.content, parse_only=BABA_UNITS))
+
+    # parse date and weather from the baba index page
+    # return: url of the ground condition page of every course listed, example -> {'東京': 'https://...'}
+    @timed('parse', stage='baba_index')
+    def parse_index(self, soup:BeautifulSoup) -> dict[str, str]:
         date = [x for x in soup.find_all('span', attrs={'class': 'date'}) if x.get('class')[0]=='date']
         if 1<len(date):
             raise RuntimeError ('Unexpectedly get more than 1 date')
@@ -81,13 +95,11 @@ class JRAGroundCondition(GroundCondition):
             location_url.append(url)
 
         location_list = [s.replace('競馬場', '') for s in location_list]
+        return dict(zip(location_list, location_url))
 
-        index_num = location_list.index(self.location)
-        url = location_url[index_num]
-
-        res = requests.get(url)
-        soup = BeautifulSoup(res.content, 'lxml')
-
+    # parse 芝 and ダート condition from the page of one course
+    @timed('parse', stage='baba')
+    def parse_location(self, soup:BeautifulSoup):
         class_data_list_unit = soup.find_all('div', attrs={'class': 'data_list_unit'})
         for i in class_data_list_unit:
             tag_h4 = i.find_all('h4')
@@ -104,3 +116,81 @@ class JRAGroundCondition(GroundCondition):
                 tag_p = i.find_all('p')
                 self.dart_condition = tag_p[0].text
 
+# Ground condition of several courses in one pass
+# the index page is fetched once and the course pages concurrently
+# locations: None takes every course listed on the index page
+# Example:
+#   conditions = JRAGroundConditions()
+#   conditions.to_df()
+#   conditions.refresh()  # on race day, returns the courses whose page changed
+class JRAGroundConditions(GroundCondition):
+    def __init__(self,
+                locations:list[RaceLocation|str]|None = None,
+                init:bool = True,
+                url:str = 'https://www.jra.go.jp/keiba/baba/',
+                transport:Transport|None = None,
+                max_workers:int = 4):
+        self.url = url
+        self.transport = transport or default_transport()
+        self.locations = None if locations is None else [
+            x.name if isinstance(x, RaceLocation) else x for x in locations]
+        self.max_workers = max_workers
+        self.conditions:dict[str, JRAGroundCondition] = dict()
+        self._digests:dict[str, str] = dict()
+        if init:
+          self.init()
+
+    @timed('build', table='ground_condition')
+    def to_df(self):
+        if not self.conditions:
+            return pd.DataFrame()
+        return pd.concat([x.to_df() for x in self.conditions.values()], ignore_index=True)
+
+    def init(self):
+        self.refresh()
+
+    # re-fetch the index and the course pages, only pages whose content changed are parsed again
+    # with locations=None, courses no longer listed on the index page are dropped
+    # return: locations whose ground condition page changed
+    def refresh(self) -> list[str]:
+        res = self.transport.get(self.url, kind=URLKind.baba)
+        soup = make_soup(res.content)
+
+        listed = self.locations or self.__listed(soup)
+        for location in [x for x in self.conditions if x not in listed]:
+            del self.conditions[location]
+            self._digests.pop(location, None)
+        for location in listed:
+            if location not in self.conditions:
+                self.conditions[location] = JRAGroundCondition(
+                    location, init=False, url=self.url, transport=self.transport)
+        if not self.conditions:
+            return list()
+        # the index is parsed once, date and weather are the same for every course
+        first, *others = self.conditions.values()
+        location_url = first.parse_index(soup)
+        for condition in others:
+            condition.date, condition.weather = first.date, first.weather
+        missing = [x for x in self.conditions if x not in location_url]
+        if missing:
+            raise RuntimeError(f'No ground condition page for {missing}')
+
+        locations = list(self.conditions)
+        pages = map_concurrent(
+            lambda x: self.transport.get(location_url[x], kind=URLKind.baba).content, 
+            locations, self.max_workers)
+        changed = list()
+        for location, content in zip(locations, pages):
+            digest = hashlib.sha1(content).hexdigest()
+            if self._digests.get(location) == digest:
+                continue
+            self._digests[location] = digest
+            self.conditions[location].parse_location(make_soup(content, parse_only=BABA_UNITS))
+            changed.append(location)
+        return changed
+
+    def __listed(self, soup:BeautifulSoup) -> list[str]:
+        class_nav_tab = soup.find_all('div', attrs={'class': 'nav tab'})
+        if not class_nav_tab:
+            return list()
+        return [x.text.replace('競馬場', '') for x in class_nav_tab[0].find_all('a')]
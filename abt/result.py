@@ -1,20 +1,15 @@
-from pydoc import TextRepr
-import requests
-from bs4 import BeautifulSoup, Tag, NavigableString, Comment
+from bs4 import BeautifulSoup, Tag
 import pandas as pd
-from tqdm import tqdm
-import itertools
-
-# ------------------------------------
-# import
-# ------------------------------------
-import time
-import re
-import pandas as pd
-import os
-import datetime
+from functools import cached_property
+
 from abc import ABC, abstractmethod
 
+from . import racekey, schema
+from .const import URLKind
+from .instrument import timed
+from .parser import make_soup, PAYOUT_ROWS, RESULT_TABLES
+from .transport import Transport, default_transport
+
 
 class Result(ABC):
     
@@ -26,63 +21,99 @@ class Result(ABC):
     def data(self):
         pass
     
+# The page is fetched and each section (payouts, ranking) parsed on first access
+# init=False fetches nothing until then. Both sections are indexed by raceKey.
 class NKBResult(Result):
     
-    def __init__(self, url, init=True) -> None:
+    def __init__(self, url, init=True, transport:Transport|None = None) -> None:
         self.url = url
-        self.soup = self.__get_soup(url)
-        self._data = pd.DataFrame()
-    #     if init:
-    #         self.init()
+        self.transport = transport or default_transport()
+        if init:
+            self.init()
 
+    # fetch the page and parse the payouts now instead of on first access
     def init(self):
-        pass
-        # self._data = self.get_result()
+        self.payouts
 
     def data(self) -> pd.DataFrame:
-      return self._data.reset_index()
+      return self.payouts.reset_index()
+
+    # integer race key (abt.racekey) of the url, -1 when the url has no race id
+    @cached_property
+    def race_key(self) -> int:
+        return int(racekey.from_url([self.url])[0])
+
+    @cached_property
+    def soup(self) -> BeautifulSoup:
+        return self.__get_soup(self.url)
+
+    @cached_property
+    def payouts(self) -> pd.DataFrame:
+        return racekey.keyed(self.get_result(self.soup), self.race_key)
+
+    @cached_property
+    def ranking(self) -> pd.DataFrame:
+        return racekey.keyed(self.get_ranking(self.soup), self.race_key)
         
     def __get_soup(self, url:str) -> BeautifulSoup:
-      res = requests.get(url) 
-      return BeautifulSoup(res.content, 'lxml') 
-
-    def __get_tansho(self, tag:Tag):
-        result = {'ticketType':'Tansho'}
-        result['pattern'] = [x.text for x in tag.find('td',class_='Result').find_all('span') if x.text!='']
-        result['payoff'] = [x.text for x in tag.find('td', class_='Payout').find_all('span') if x.text!='']
-        return result
-    
-    def __get_fukusho(self, tag:Tag):
-        result = {'ticketType':'fukusho'}
-        result['pattern'] = [x.text for x in tag.find('td',class_='Result').find_all('span') if x.text!='']
-        result['payoff'] = [x.text for x in tag.find('td', class_='Payout').find_all('span') if x.text!='']
-        return result
-
-    def __get_wide(self, tag:Tag):
-        result = {'ticketType':'wide'}
-        result['pattern'] = [[y.text for y in x.find_all('span')] for x in  tag.find_all('ul') if x.text !='']
-        result['payoff'] = [x.text for x in tag.find('td', class_='Payout').find_all('span') if x.text!='']
-        return result
+      res = self.transport.get(url, kind=URLKind.result) 
+      soup = make_soup(res.content, parse_only=RESULT_TABLES)
+      # payouts are not published yet, do not keep this page as a permanent result
+      if soup.find('tr', class_='Tansho') is None:
+        self.transport.invalidate(url)
+      return soup
 
+    @timed('parse', stage='payouts')
     def get_result(self, soup:BeautifulSoup) -> pd.DataFrame:
-        typesI = ['Tansho', 'Fukusho', 'Wide']
-        tags=soup.find_all("tr",class_=typesI)
-        rows = list()
-        for tag in tags:
-          rows.append(getattr(self,f'_NKBResult__get_{tag["class"][0].lower()}')(tag))
-        return pd.DataFrame(rows)
-
-
-    # def get_result(self) -> pd.DataFrame:
-    #     tags = self.soup.find('tbody')
-    #     rows = list()
-    #     if isinstance(tags, Tag):
-    #         tags = tags.find_all('tr')
-    #     else:
-    #         raise RuntimeError('cannot find result table')
-    #     for tag in tags:
-    #         rows.append({
-    #             'horseNum':tag.find('td', class_='Num Txt_C').find('div').text,
-    #             'rank':tag.find('div', class_='Rank').text,
-    #             'rank1Odds':''})
-    #     return pd.DataFrame(rows)
+        return schema.apply(pd.DataFrame(payout_rows(soup)), schema.PAYOUT)
+
+    # finishing order, one row per horse
+    @timed('parse', stage='ranking')
+    def get_ranking(self, soup:BeautifulSoup) -> pd.DataFrame:
+        return schema.apply(pd.DataFrame(ranking_rows(soup)), schema.RANKING)
+
+# Row parsers shared by NKBResult and the fetch/parse pipeline
+
+def _get_tansho(tag:Tag):
+    result = {'ticketType':'Tansho'}
+    result['pattern'] = [x.text for x in tag.find('td',class_='Result').find_all('span') if x.text!='']
+    result['payoff'] = [x.text for x in tag.find('td', class_='Payout').find_all('span') if x.text!='']
+    return result
+
+def _get_fukusho(tag:Tag):
+    result = {'ticketType':'fukusho'}
+    result['pattern'] = [x.text for x in tag.find('td',class_='Result').find_all('span') if x.text!='']
+    result['payoff'] = [x.text for x in tag.find('td', class_='Payout').find_all('span') if x.text!='']
+    return result
+
+def _get_wide(tag:Tag):
+    result = {'ticketType':'wide'}
+    result['pattern'] = [[y.text for y in x.find_all('span')] for x in  tag.find_all('ul') if x.text !='']
+    result['payoff'] = [x.text for x in tag.find('td', class_='Payout').find_all('span') if x.text!='']
+    return result
+
+_ticket_parsers = {'tansho': _get_tansho, 'fukusho': _get_fukusho, 'wide': _get_wide}
+
+def payout_rows(soup:BeautifulSoup) -> list[dict]:
+    typesI = ['Tansho', 'Fukusho', 'Wide']
+    tags=soup.find_all("tr",class_=typesI)
+    rows = list()
+    for tag in tags:
+      rows.append(_ticket_parsers[tag["class"][0].lower()](tag))
+    return rows
+
+def ranking_rows(soup:BeautifulSoup) -> list[dict]:
+    tags = soup.find('tbody')
+    rows = list()
+    if isinstance(tags, Tag):
+        tags = tags.find_all('tr')
+    else:
+        raise RuntimeError('cannot find result table')
+    for tag in tags:
+        rows.append({
+            'horseNum':tag.find('td', class_='Num Txt_C').find('div').text,
+            'rank':tag.find('div', class_='Rank').text})
+    return rows
+
+def parse_payouts(content:bytes) -> list[dict]:
+    return payout_rows(make_soup(content, parse_only=PAYOUT_ROWS))
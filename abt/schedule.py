@@ -1,20 +1,39 @@
 
 import datetime
+import hashlib
 import pandas as pd
-import requests
 import re
 
-from webdriver_manager.chrome import ChromeDriverManager
-from selenium import webdriver
-from selenium.webdriver.chrome.service import Service as ChromeService
-from selenium.webdriver.common.by import By
 from bs4 import BeautifulSoup, Tag
 from urllib.parse import urljoin
 
 from enum import Enum
+from typing import NamedTuple
 from abc import ABC, abstractmethod
 
-from abt.const import RaceLocation
+from abt import racekey, schema
+from abt.const import RaceLocation, URLKind
+from abt.instrument import span, timed
+from abt.parser import make_soup, RACE_TIME
+from abt.pool import map_concurrent
+from abt.transport import Transport, default_transport
+
+# netkeiba race id: year, location, round (回), day (日), race, e.g. 202305050811
+def build_netkeiba_race_id(location:str, year:int, round, day, race) -> str:
+    locationId=f"{RaceLocation[location].value:02d}"
+    return "".join([str(year), locationId]+[f'{int(x):02d}' for x in [round, day, race]])
+
+def build_netkeiba_url(race_id:str, mode:str = 'shutuba') -> str:
+    return f'https://race.netkeiba.com/race/{mode}.html?race_id={race_id}'
+
+# races that changed between two builds of a schedule, rows in JRASchedule.data() format
+class ScheduleDiff(NamedTuple):
+    added: pd.DataFrame
+    removed: pd.DataFrame
+    modified: pd.DataFrame     # new rows of races whose start time or urls changed
+
+    def empty(self) -> bool:
+        return self.added.empty and self.removed.empty and self.modified.empty
 
 class Schedule(ABC):
     
@@ -31,22 +50,169 @@ class JRASchedule(Schedule):
     def data(self):
         return self._data.reset_index()
     
-    def __init__(self, init:bool = True) -> None:
+    # max_workers: number of pages fetched in parallel, 1 to fetch serially
+    # transport: HTTP transport, bounds concurrent requests per host
+    # browser: None tries plain HTTP navigation first and falls back to selenium,
+    #          True always drives chrome, False never does
+    def __init__(self, 
+                 init:bool = True, 
+                 max_workers:int = 8, 
+                 transport:Transport|None = None,
+                 browser:bool|None = None) -> None:
         self._data:pd.DataFrame = pd.DataFrame()
+        self.max_workers = max_workers
+        self.transport = transport or default_transport()
+        self.browser = browser
+        # 開催ページの一覧, the races of every round page, the start time of every race page and
+        # the digests of the pages last parsed
+        self._locations:pd.DataFrame = pd.DataFrame()
+        self._rounds:dict[str, list[dict]] = dict()
+        self._times:dict[str, dict] = dict()
+        self._digests:dict[tuple[str, str], str] = dict()
         if init:
           self.init()
 
     def init(self):
-      basesoup = self.__access_entries()
-      self._data = self.get_location_url(basesoup)
-      self._data = pd.concat(
-          self._data["url"].apply(
-            lambda x: self.fetch_race_url_from_round_url(x)).to_list()) # type: ignore
-      self._data['netkeibaURL'] = self.get_netkeiba_shutsuba_url(self._data)
-      self._data['resultURL'] = self.get_netkeiba_result_url(self._data)
+      basesoup = self.__discover()
+      self._locations = self.get_location_url(basesoup)
+      self._rounds.clear()
+      self._times.clear()
+      self._digests.clear()
+      self.__sync(refetch=False)
+
+    # Update the schedule with the pages that changed since the last build
+    # every round and race page is revalidated through the transport: with a CachedTransport an
+    # unchanged page costs a conditional GET answered by 304, other transports fetch it in full.
+    # Only the pages whose content changed are parsed again.
+    # rediscover: navigate to the round pages again, picks up meetings added since the last build
+    # return: added, removed and modified races
+    def refresh(self, rediscover:bool = False) -> ScheduleDiff:
+      old = self._data
+      if rediscover or self._locations.empty:
+        self._locations = self.get_location_url(self.__discover())
+      self.__sync(refetch=True)
+      return self.diff(old, self._data)
+
+    @staticmethod
+    def diff(old:pd.DataFrame, new:pd.DataFrame) -> ScheduleDiff:
+      if old.empty or new.empty:
+        return ScheduleDiff(new.reset_index(), old.reset_index(), new.iloc[:0].reset_index())
+      common = new.index.intersection(old.index)
+      cols = [x for x in new.columns if x in old.columns]
+      changed = (new.loc[common, cols].astype(str) != old.loc[common, cols].astype(str)).any(axis=1)
+      return ScheduleDiff(new.loc[new.index.difference(old.index)].reset_index(),
+                          old.loc[old.index.difference(new.index)].reset_index(),
+                          new.loc[changed[changed].index].reset_index())
+
+    # refetch: revalidate cached copies so that a CachedTransport does not hide changes
+    def __sync(self, refetch:bool) -> None:
+      urls = self._locations['url'].to_list() if not self._locations.empty else list()
+      # 各開催のページを並列に取得する
+      pages = map_concurrent(lambda x: self.__fetch(x, refetch), urls, self.max_workers)
+      for url, content in zip(urls, pages):
+        if self.__changed('round', url, content) or url not in self._rounds:
+          with span('parse', stage='round'):
+            self._rounds[url] = round_rows(make_soup(content))
+      self._rounds = {k:v for k, v in self._rounds.items() if k in urls}
+      rows = [x for url in urls for x in self._rounds[url]]
+      # 全開催のレースページをまとめて並列に取得する
+      # every race page is revalidated, a round page only shows the first race and a start
+      # time can change on any race page; only the pages whose content changed are parsed again.
+      # max_workers applies per meeting, the transport still bounds the requests per host
+      workers = self.max_workers*len(urls) if self.max_workers > 1 else 1
+      pages = map_concurrent(lambda x: self.__fetch(x['url'], refetch), rows, workers)
+      for row, content in zip(rows, pages):
+        if self.__changed('time', row['url'], content) or row['url'] not in self._times:
+          with span('parse', stage='time'):
+            self._times[row['url']] = race_time(make_soup(content, parse_only=RACE_TIME))
+      known = set(urls) | {x['url'] for x in rows}
+      self._digests = {k:v for k, v in self._digests.items() if k[1] in known}
+      self._times = {k:v for k, v in self._times.items() if k in known}
+      with span('build', table='schedule') as s:
+        if not rows:
+          self._data = pd.DataFrame()
+          return
+        data = pd.DataFrame([with_time(x, self._times[x['url']]) for x in rows])
+        # rows are indexed by the integer race key, data() returns it as the raceKey column
+        data.index = pd.Index(racekey.from_frame(data), name='raceKey')
+        data['netkeibaURL'] = self.get_netkeiba_shutsuba_url(data)
+        data['resultURL'] = self.get_netkeiba_result_url(data)
+        # after the url columns, so that they get their declared type as well
+        self._data = schema.apply(data, schema.SCHEDULE)
+        s.field(rows=len(self._data))
+
+    def __fetch(self, url:str, refetch:bool) -> bytes:
+      if refetch:
+        return self.transport.revalidate(url, kind=URLKind.schedule).content
+      return self.transport.get(url, kind=URLKind.schedule).content
+
+    # True when the page differs from the one last parsed as stage, the new digest is kept
+    # the first race page may be served under the url of its round page, so digests are per stage
+    def __changed(self, stage:str, url:str, content:bytes) -> bool:
+      digest = hashlib.sha1(content).hexdigest()
+      if self._digests.get((stage, url)) == digest:
+        return False
+      self._digests[(stage, url)] = digest
+      return True
+
+    def __discover(self) -> BeautifulSoup:
+      if self.browser:
+        return self.__access_entries()
+      try:
+        return self.__request_entries()
+      except Exception as e:
+        if self.browser is False:
+          raise
+        # selenium is optional, report the HTTP failure when it is not installed
+        try:
+          return self.__access_entries()
+        except ImportError:
+          raise e
+
+    # follow a JRA navigation link without a browser
+    # links are either plain hrefs or doAction('/JRADB/accessX.html', 'cname') form posts
+    def __follow(self, tag:Tag|None, base:str) -> BeautifulSoup:
+      if tag is None:
+        raise RuntimeError('No navigation link found, please check code')
+      link = tag if tag.name == 'a' else tag.find('a')
+      if not isinstance(link, Tag):
+        link = tag
+      action = re.search(r"doAction\(\s*'([^']+)'\s*,\s*'([^']+)'", str(link.get('onclick', '')))
+      href = link.get('href')
+      if action is not None:
+        res = self.transport.post(urljoin(base, action.group(1)), data={'cname': action.group(2)})
+      elif href and not str(href).startswith(('#', 'javascript')):
+        res = self.transport.get(urljoin(base, str(href)), kind=URLKind.schedule)
+      else:
+        raise RuntimeError('Can not follow navigation link, please check code')
+      return make_soup(res.content)
+
+    # same navigation as __access_entries with plain HTTP requests
+    def __request_entries(self) -> BeautifulSoup:
+      base = 'https://www.jra.go.jp/'
+      # 出馬表
+      res = self.transport.post(urljoin(base, '/JRADB/accessD.html'), data={'cname': 'pw01dli00/F3'})
+      soup = make_soup(res.content)
+
+      # 「今週の出馬表」の左端の開催
+      soup = self.__follow(soup.select_one('#main > div:nth-of-type(2) > div > div > div:nth-of-type(1) a'), base)
+
+      # ラウンド
+      soup = self.__follow(soup.select_one('#race_list > tbody > tr:nth-of-type(1) > th'), base)
+      if not soup.find_all('div', attrs={'class': 'link_list multi div3 center mid narrow'}):
+        raise RuntimeError('No location links found, please check code')
+      return soup
 
         # redirect to the page where each race url can be found
     def __access_entries(self) -> BeautifulSoup:
+      try:
+        from webdriver_manager.chrome import ChromeDriverManager
+        from selenium import webdriver
+        from selenium.webdriver.chrome.service import Service as ChromeService
+        from selenium.webdriver.common.by import By
+      except ImportError as e:
+        raise ImportError('selenium and webdriver_manager are required for browser navigation') from e
+
       # chromeを起動する
       option = webdriver.ChromeOptions()
       option.add_argument('--no-sandbox')
@@ -79,25 +245,18 @@ class JRASchedule(Schedule):
 
       # 表示しているページのURLを取得する
       cur_url = browser.current_url
-      res = requests.get(cur_url)  # 指定したURLからデータを取得する
-      soup = BeautifulSoup(res.content, 'lxml')  # content形式で取得したデータをhtml形式で分割する
+      browser.quit()
+      res = self.transport.get(cur_url, kind=URLKind.schedule)  # 指定したURLからデータを取得する
+      soup = make_soup(res.content)  # content形式で取得したデータをhtml形式で分割する
 
       return soup
     
-    def __parseLocationRoundKai(self, text:str|None):
-        if text is None: raise  RuntimeError('No date text')
-        day = re.findall(r"(\d+)日", text)
-        kai = re.findall(r"(\d+)回", text)
-        place = re.findall(r'(?<={}回).*?(?={}日)'.format(kai, day), text)
-        if any([1!=len(x) for x in [day, kai, place]]):
-            raise RuntimeError("number of count of day, kai or place is not 1")
-        return {'location':place[0], 'round':kai[0], 'day':day[0]}
-    
     # 開催場所のURLを取得する
     # 「5回東京5日」「5回阪神5日」などのURLを取得する
     # arg: soup
     # return: dataFrame of location, round, day, url
     # example -> for 5回東京1日 location:東京, round:5, day:1, url: https//www.abc.def
+    @timed('parse', stage='locations')
     def get_location_url(self, soup:BeautifulSoup):
         locations_info = soup.find_all('div', attrs={'class': 'link_list multi div3 center mid narrow'})
 
@@ -109,7 +268,7 @@ class JRASchedule(Schedule):
         url_dfs = []
         for locations in locations_info:
             for location in locations.find_all('a'):
-                res = self.__parseLocationRoundKai(location.text)
+                res = _parse_location_round_kai(location.text)
                 url = urljoin('https://www.jra.go.jp', location.get('href'))
                 url_dfs.append(res|{'url':url})
                 location_url.append(url)
@@ -117,78 +276,100 @@ class JRASchedule(Schedule):
         return pd.DataFrame(url_dfs)
 
     def fetch_race_url_from_round_url(self, url:str) -> pd.DataFrame:
-        res = requests.get(url)
-        soup = BeautifulSoup(res.content, 'html5lib')
+        res = self.transport.get(url, kind=URLKind.schedule)
+        soup = make_soup(res.content)
         return self.get_round_url(soup)
   
-    def __parseDate(self, text:str|None) -> dict:
-        if text is None: raise  RuntimeError('No date text')
-        year = re.findall(r"(\d+)年", text)
-        month = re.findall(r"(\d+)月", text)
-        day = re.findall(r"(\d+)日", text)
-        if any([1<len(x) for x in [year, month, day]]):
-            raise RuntimeError("more than one year, month or day found in string")
-        return {'date':datetime.date(int(year[0]), int(month[0]), int(day[0]))}
-    
-    def __parseTime(self, text:str|None) -> dict:
-        if text is None: raise  RuntimeError('No date text')
-        hour = re.findall(r"(\d+)時", text)
-        minute = re.findall(r"(\d+)分", text)
-        if any([1<len(x) for x in [hour, minute]]):
-            raise RuntimeError("more than one year, month or day found in string")
-        return {'startHour':int(hour[0]), 'startMinute':int(minute[0])}
-    
+    # parse spans cover the soup and the rows only, request time is in the fetch span
     def getTime(self, url:str) -> dict:
-      res = requests.get(url)
-      soup = BeautifulSoup(res.content, 'html5lib')
-      round_meta = soup.find('div', attrs={'id': 'syutsuba'})
-      if not isinstance(round_meta, Tag):
-          raise RuntimeError('No Round info found, please check code')
-      meta_text = round_meta.find('div', attrs={'class':'cell date'})
-      time_text = round_meta.find('div', attrs={'class':'cell time'})
-      time_text = time_text.find('strong') if time_text is not None else None
-      time_text = time_text.text if isinstance(time_text, Tag) else None
-      return self.__parseTime(time_text)
-    
+      res = self.transport.get(url, kind=URLKind.schedule)
+      with span('parse', stage='time'):
+        return race_time(make_soup(res.content, parse_only=RACE_TIME))
 
     def get_round_url(self, soup:BeautifulSoup) -> pd.DataFrame:
-      rounds_info = soup.find('ul', attrs={'class': 'nav race-num mt15'})
-      round_meta = soup.find('div', attrs={'id': 'syutsuba'})
-      if not isinstance(round_meta, Tag):
-          raise RuntimeError('No Round info found, please check code')
-      meta_text = round_meta.find('div', attrs={'class':'cell date'})
-      round_text = meta_text.text.split(' ')[-1] if meta_text is not None else None
-      date_text = meta_text.text.split(' ')[0] if meta_text is not None else None
-      round_data = self.__parseLocationRoundKai(round_text)
-      date = self.__parseDate(date_text)
-      # ラウンドのURLを保存するリストを用意
-      round_url = []
-
-      if not isinstance(rounds_info, Tag):
-        raise RuntimeError('No Round info found, please check code')
-      # リンクページのURLを作成する
-      for round in rounds_info.find_all('a'): 
-          url = urljoin('https://www.jra.go.jp', round.get('href'))
-          race = int(re.findall(r"\d+", round.find('img', alt=True)['alt'])[0])
-          time = self.getTime(url)
-          round_url.append(date|time|round_data|{'race':race, 'url':url})
-      return pd.DataFrame(round_url)
-
-    def __build_netkeiba_raceId(self, location, date, round, day, race):
-      locationId=f"{RaceLocation[location].value:02d}"
-      year = str(date.year)
-      return "".join([year, locationId]+[f'{int(x):02d}' for x in [round, day, race]])
-
-    def __build_netkeiba_url(self, meta, mode='shutuba'):
-      prefix = f'https://race.netkeiba.com/race/{mode}.html?race_id='
-      return f'{prefix}{self.__build_netkeiba_raceId(**meta)}'
-    
+      with span('parse', stage='round'):
+        round_url = round_rows(soup)
+      # 各レースの発走時刻を並列に取得する
+      times = map_concurrent(self.getTime, [x['url'] for x in round_url], self.max_workers)
+      return pd.DataFrame([with_time(x, time) for x, time in zip(round_url, times)])
+
     def get_netkeiba_shutsuba_url(self, data:pd.DataFrame) -> pd.Series:
-        meta_cols = ['date', 'location', 'round','day', 'race']
-        return data[meta_cols].apply(lambda x: self.__build_netkeiba_url(x), axis=1)
+        return self.__netkeiba_url(data, 'shutuba')
     
     def get_netkeiba_result_url(self, data:pd.DataFrame) -> pd.Series: 
-        meta_cols = ['date', 'location', 'round','day', 'race']
-        return data[meta_cols].apply(lambda x: self.__build_netkeiba_url(x, mode='result'), axis=1)
+        return self.__netkeiba_url(data, 'result')
+
+    def __netkeiba_url(self, data:pd.DataFrame, mode:str) -> pd.Series:
+        keys = data.index if data.index.name == 'raceKey' else racekey.from_frame(data)
+        return racekey.to_url(keys, mode).set_axis(data.index)
+
+# Page parsers shared by JRASchedule and the fetch/parse pipeline
+
+def _parse_location_round_kai(text:str|None):
+    if text is None: raise  RuntimeError('No date text')
+    day = re.findall(r"(\d+)日", text)
+    kai = re.findall(r"(\d+)回", text)
+    place = re.findall(r'(?<={}回).*?(?={}日)'.format(kai, day), text)
+    if any([1!=len(x) for x in [day, kai, place]]):
+        raise RuntimeError("number of count of day, kai or place is not 1")
+    return {'location':place[0], 'round':kai[0], 'day':day[0]}
+
+def _parse_date(text:str|None) -> dict:
+    if text is None: raise  RuntimeError('No date text')
+    year = re.findall(r"(\d+)年", text)
+    month = re.findall(r"(\d+)月", text)
+    day = re.findall(r"(\d+)日", text)
+    if any([1<len(x) for x in [year, month, day]]):
+        raise RuntimeError("more than one year, month or day found in string")
+    return {'date':datetime.date(int(year[0]), int(month[0]), int(day[0]))}
+
+def _parse_time(text:str|None) -> dict:
+    if text is None: raise  RuntimeError('No date text')
+    hour = re.findall(r"(\d+)時", text)
+    minute = re.findall(r"(\d+)分", text)
+    if any([1<len(x) for x in [hour, minute]]):
+        raise RuntimeError("more than one year, month or day found in string")
+    return {'startHour':int(hour[0]), 'startMinute':int(minute[0])}
+
+# start time of one race page
+def race_time(soup:BeautifulSoup) -> dict:
+    round_meta = soup.find('div', attrs={'id': 'syutsuba'})
+    if not isinstance(round_meta, Tag):
+        raise RuntimeError('No Round info found, please check code')
+    time_text = round_meta.find('div', attrs={'class':'cell time'})
+    time_text = time_text.find('strong') if time_text is not None else None
+    time_text = time_text.text if isinstance(time_text, Tag) else None
+    return _parse_time(time_text)
+
+# races listed on a round page: date, location, round, day, race, url
+def round_rows(soup:BeautifulSoup) -> list[dict]:
+    rounds_info = soup.find('ul', attrs={'class': 'nav race-num mt15'})
+    round_meta = soup.find('div', attrs={'id': 'syutsuba'})
+    if not isinstance(round_meta, Tag):
+        raise RuntimeError('No Round info found, please check code')
+    meta_text = round_meta.find('div', attrs={'class':'cell date'})
+    round_text = meta_text.text.split(' ')[-1] if meta_text is not None else None
+    date_text = meta_text.text.split(' ')[0] if meta_text is not None else None
+    round_data = _parse_location_round_kai(round_text)
+    date = _parse_date(date_text)
+    # ラウンドのURLを保存するリストを用意
+    round_url = []
+
+    if not isinstance(rounds_info, Tag):
+      raise RuntimeError('No Round info found, please check code')
+    # リンクページのURLを作成する
+    for round in rounds_info.find_all('a'): 
+        url = urljoin('https://www.jra.go.jp', round.get('href'))
+        race = int(re.findall(r"\d+", round.find('img', alt=True)['alt'])[0])
+        round_url.append(date|round_data|{'race':race, 'url':url})
+    return round_url
+
+# schedule row with its start time, in JRASchedule column order
+def with_time(row:dict, time:dict) -> dict:
+    return {'date':row['date']}|time|{k:v for k, v in row.items() if k != 'date'}
 
+def parse_round(content:bytes) -> list[dict]:
+    return round_rows(make_soup(content))
 
+def parse_race_time(content:bytes) -> dict:
+    return race_time(make_soup(content, parse_only=RACE_TIME))
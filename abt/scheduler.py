@@ -0,0 +1,183 @@
+import datetime
+import heapq
+import itertools
+import time
+from typing import Callable, Iterator, NamedTuple
+
+import pandas as pd
+
+from . import racekey
+from .pool import TokenBucket
+from .reference import JRAGroundConditions
+from .shutsuba import NKBJRAShutsuba
+from .transport import Transport, default_transport
+
+# Fetch scheduler for race day, built from JRASchedule.data()
+#
+#   card  race card (netkeiba), fetched once card_lead before post
+#   odds  JRA odds, polled from odds_lead before post, more often as post approaches (intervals),
+#         one last time grace after post, then the race is dropped
+#   baba  ground condition of every location, refreshed every baba_interval until the last race
+#
+# Every request takes a token from one bucket (rate requests per second). When several tasks are
+# due and the budget is short, the race closest to post goes first.
+# Example:
+#   scheduler = RaceScheduler(JRASchedule().data(), rate=2)
+#   for update in scheduler.run():
+#       print(update.kind, update.key, update.data)
+
+# (time left before post, odds poll interval), the first row whose bound covers the time left applies
+DEFAULT_INTERVALS:list[tuple[datetime.timedelta, datetime.timedelta]] = [
+    (datetime.timedelta(minutes=3), datetime.timedelta(seconds=10)),
+    (datetime.timedelta(minutes=10), datetime.timedelta(seconds=30)),
+    (datetime.timedelta(minutes=30), datetime.timedelta(minutes=1)),
+    (datetime.timedelta(hours=1), datetime.timedelta(minutes=5)),
+    (datetime.timedelta.max, datetime.timedelta(minutes=15)),
+]
+
+class Update(NamedTuple):
+    kind: str                  # card, odds or baba
+    key: int|None              # raceKey (abt.racekey), None for baba
+    data: pd.DataFrame|None    # None when the odds or the ground condition did not change
+    time: datetime.datetime
+
+# order of tasks due for the same race
+_rank = {'baba': 0, 'card': 1, 'odds': 2}
+
+class RaceScheduler:
+    def __init__(self,
+                 schedule:pd.DataFrame,
+                 transport:Transport|None = None,
+                 rate:float = 1,
+                 burst:int = 5,
+                 intervals:list[tuple[datetime.timedelta, datetime.timedelta]] = DEFAULT_INTERVALS,
+                 odds_lead:datetime.timedelta = datetime.timedelta(hours=2),
+                 card_lead:datetime.timedelta = datetime.timedelta(hours=3),
+                 baba_interval:datetime.timedelta = datetime.timedelta(minutes=15),
+                 grace:datetime.timedelta = datetime.timedelta(minutes=2),
+                 retry:datetime.timedelta = datetime.timedelta(minutes=1),
+                 clock:Callable[[], datetime.datetime] = datetime.datetime.now,
+                 sleep:Callable[[float], None] = time.sleep) -> None:
+        self.transport = transport or default_transport()
+        self.intervals = intervals
+        self.odds_lead = odds_lead
+        self.card_lead = card_lead
+        self.baba_interval = baba_interval
+        self.grace = grace
+        self.retry = retry
+        self.clock = clock
+        self.sleep = sleep
+        self.errors:list[dict] = list()
+
+        self.races:dict[int, dict] = dict()
+        for key, race in zip(racekey.from_schedule(schedule), schedule.to_dict('records')):
+            date = pd.Timestamp(race['date']).date()
+            post = datetime.datetime.combine(date, datetime.time(int(race['startHour']), int(race['startMinute'])))
+            self.races[int(key)] = {'post': post, 'location': str(race['location']),
+                                    'netkeibaURL': race['netkeibaURL'], 'url': race['url']}
+        self.shutsuba:dict[int, NKBJRAShutsuba] = dict()
+        locations = sorted({x['location'] for x in self.races.values()})
+        self.ground = JRAGroundConditions(locations, init=False, transport=self.transport) if locations else None
+
+        # the index page and one page per location
+        self._cost = {'card': 1, 'odds': 1, 'baba': 1 + len(locations)}
+        self._bucket = TokenBucket(rate, max(burst, self._cost['baba']), clock=lambda: self.clock().timestamp())
+        self._seq = itertools.count()
+        # (due, post, rank, seq, kind, key) by due time, and the due tasks by post time
+        self._queue:list[tuple] = list()
+        self._ready:list[tuple] = list()
+        for key, race in self.races.items():
+            self.__push('card', key, race['post'] - card_lead)
+            self.__push('odds', key, race['post'] - odds_lead)
+        if self.races:
+            first = min(x['post'] for x in self.races.values())
+            self.__push('baba', None, first - card_lead)
+
+    # odds poll interval for the time left before post
+    def interval(self, remaining:datetime.timedelta) -> datetime.timedelta:
+        for bound, interval in self.intervals:
+            if remaining <= bound:
+                return interval
+        return self.intervals[-1][1]
+
+    def pending(self) -> int:
+        return len(self._queue) + len(self._ready)
+
+    # run the tasks as they become due and yield what they fetched
+    # stops at until or when every race is finished
+    def run(self, until:datetime.datetime|None = None) -> Iterator[Update]:
+        while self._queue or self._ready:
+            now = self.clock()
+            if until is not None and until <= now:
+                return
+            while self._queue and self._queue[0][0] <= now:
+                due, post, rank, seq, kind, key = heapq.heappop(self._queue)
+                heapq.heappush(self._ready, (post, rank, seq, due, kind, key))
+            if not self._ready:
+                self.__wait(self._queue[0][0] - now, until)
+                continue
+            post, rank, seq, due, kind, key = self._ready[0]
+            wait = self._bucket.take(self._cost[kind])
+            if wait:
+                # tasks that become due meanwhile may be closer to post
+                self.__wait(datetime.timedelta(seconds=wait), until)
+                continue
+            heapq.heappop(self._ready)
+            update = self.__execute(kind, key, now)
+            if update is not None:
+                yield update
+
+    def __wait(self, delay:datetime.timedelta, until:datetime.datetime|None) -> None:
+        if until is not None:
+            delay = min(delay, until - self.clock())
+        self.sleep(max(0, delay.total_seconds()))
+
+    def __push(self, kind:str, key:int|None, due:datetime.datetime) -> None:
+        heapq.heappush(self._queue, (due, self.__post(kind, key, due), _rank[kind], next(self._seq), kind, key))
+
+    # post time used to prioritise a task, baba goes with the next race to start
+    def __post(self, kind:str, key:int|None, due:datetime.datetime) -> datetime.datetime:
+        if key is not None:
+            return self.races[key]['post']
+        upcoming = [x['post'] for x in self.races.values() if due <= x['post']]
+        return min(upcoming) if upcoming else due
+
+    def __race(self, key:int) -> NKBJRAShutsuba:
+        if key not in self.shutsuba:
+            race = self.races[key]
+            self.shutsuba[key] = NKBJRAShutsuba(race['netkeibaURL'], race['url'], init=False, transport=self.transport)
+        return self.shutsuba[key]
+
+    def __execute(self, kind:str, key:int|None, now:datetime.datetime) -> Update|None:
+        try:
+            if kind == 'card':
+                data = self.__race(key).horses
+            elif kind == 'odds':
+                shutsuba = self.__race(key)
+                # the first request reads the odds, later ones poll for changes
+                data = shutsuba.odds if 'odds' not in shutsuba.__dict__ else shutsuba.poll_odds()
+            else:
+                changed = self.ground.refresh()
+                data = self.ground.to_df().query('location in @changed') if changed else None
+        except Exception as e:
+            self.errors.append({'kind': kind, 'key': key, 'time': now, 'error': repr(e)})
+            if kind == 'card' and now < self.races[key]['post']:
+                self.__push(kind, key, now + self.retry)
+            elif kind != 'card':
+                self.__reschedule(kind, key, now)
+            return None
+        self.__reschedule(kind, key, now)
+        return Update(kind, key, data, now)
+
+    def __reschedule(self, kind:str, key:int|None, now:datetime.datetime) -> None:
+        if kind == 'odds':
+            post = self.races[key]['post']
+            # the race is finished after the poll grace after post
+            if post + self.grace <= now:
+                self.shutsuba.pop(key, None)
+                return
+            self.__push(kind, key, min(now + self.interval(post - now), post + self.grace))
+        elif kind == 'baba':
+            last = max(x['post'] for x in self.races.values())
+            if now < last:
+                self.__push(kind, key, now + self.baba_interval)
@@ -0,0 +1,110 @@
+import pandas as pd
+from pandas.api.types import is_numeric_dtype
+
+from .const import RaceLocation
+
+try:
+    import pyarrow as pa
+except ImportError:
+    pa = None
+
+# Column types of the loader outputs
+# Repeated labels are categoricals, counts and numbers are the smallest nullable integer that fits,
+# text is arrow backed when pyarrow is installed. Every loader applies its schema once when the
+# frame is assembled, so concat/merge of frames from different races keeps the compact types.
+
+STRING = pd.StringDtype('pyarrow' if pa is not None else 'python')
+DATE = pd.ArrowDtype(pa.date32()) if pa is not None else object
+
+LOCATION = pd.CategoricalDtype([x.name for x in RaceLocation])
+SEX = pd.CategoricalDtype(['牡', '牝', 'セ'])
+AFFILIATIONS = pd.CategoricalDtype(['美浦', '栗東', '地方', '海外'])
+WEATHER = pd.CategoricalDtype(['晴', '曇', '小雨', '雨', '小雪', '雪'])
+GROUND_CONDITION = pd.CategoricalDtype(['良', '稍重', '重', '不良'])
+FIELD_TYPE = pd.CategoricalDtype(['芝', 'ダ', '芝/ダ'])
+TICKET_TYPE = pd.CategoricalDtype(['Tansho', 'fukusho', 'wide'])
+
+RACE = {
+    'date': DATE,
+    'location': LOCATION,
+    'round': 'UInt8',
+    'day': 'UInt8',
+    'race': 'UInt8',
+}
+
+SCHEDULE = RACE|{
+    'startHour': 'UInt8',
+    'startMinute': 'UInt8',
+    'url': STRING,
+    'netkeibaURL': STRING,
+    'resultURL': STRING,
+}
+
+SHUTSUBA = RACE|{
+    'horseNum': 'UInt8',
+    'lane': 'UInt8',
+    'horseName': STRING,
+    'horseId': STRING,
+    'trainerName': STRING,
+    'affiliations': AFFILIATIONS,
+    'trainId': STRING,
+    'isCanceled': 'bool',
+    'weight': 'Int16',
+    'weightChange': 'Int16',
+    'age': 'UInt8',
+    'sex': SEX,
+    'load': 'Float32',
+    # odds are compared and subtracted, float32 would show 9.9-3.8 as 6.099999
+    'odds': 'Float64',
+    # signed, poll_odds takes differences of popularity
+    'popularity': 'Int8',
+}
+
+RACE_META = {
+    'is_hindrance': 'UInt8',
+    'direction': 'category',
+    'ground_condition': GROUND_CONDITION,
+    'weather': WEATHER,
+    'horse_count': 'UInt8',
+    'field_type': FIELD_TYPE,
+    'distance': 'UInt16',
+}
+
+# pattern and payoff are lists per ticket and stay python objects
+PAYOUT = RACE|{
+    'ticketType': TICKET_TYPE,
+}
+
+# rank is text, cancelled or disqualified horses are ranked 取消, 除外, 中止, ...
+RANKING = RACE|{
+    'horseNum': 'UInt8',
+    'rank': STRING,
+}
+
+def _category(values:pd.Series, dtype:pd.CategoricalDtype) -> pd.CategoricalDtype:
+    # labels missing from the declared categories are appended instead of turned into NaN
+    extra = sorted(set(values.dropna().astype(str)) - set(dtype.categories))
+    if not extra:
+        return dtype
+    return pd.CategoricalDtype(list(dtype.categories)+extra)
+
+def _typed(values:pd.Series, dtype) -> bool:
+    if isinstance(dtype, pd.CategoricalDtype) and isinstance(values.dtype, pd.CategoricalDtype):
+        return set(dtype.categories) <= set(values.cat.categories)
+    return values.dtype == dtype
+
+def _cast(values:pd.Series, dtype) -> pd.Series:
+    if isinstance(dtype, pd.CategoricalDtype):
+        return values.astype(_category(values, dtype))
+    if dtype is DATE:
+        return pd.to_datetime(values).dt.date.astype(dtype)
+    if isinstance(dtype, str) and dtype[0] in 'UIF' and not is_numeric_dtype(values):
+        # numbers parsed from text, '' is missing
+        values = pd.to_numeric(values.replace('', None))
+    return values.astype(dtype)
+
+# Cast the columns of data listed in schema, other columns are left untouched
+def apply(data:pd.DataFrame, schema:dict) -> pd.DataFrame:
+    cast = {col: _cast(data[col], dtype) for col, dtype in schema.items()
+            if col in data.columns and not _typed(data[col], dtype)}
+    return data.assign(**cast) if cast else data
@@ -1,13 +1,25 @@
-import requests
-from bs4 import BeautifulSoup, Tag, NavigableString, Comment
+from bs4 import BeautifulSoup, SoupStrainer, Tag, NavigableString, Comment
 import pandas as pd
 import itertools
 
 import numpy as np
 import re
-import pandas as pd
+import asyncio
+import datetime
+import hashlib
+import time
+from collections import deque
+from functools import cached_property
+from typing import AsyncIterator, Iterator
 from abc import ABC, abstractmethod
 
+from . import racekey, schema
+from .const import URLKind
+from .instrument import span, timed
+from .parser import make_soup, HORSE_LIST, ODDS_TABLE
+from .pool import map_concurrent
+from .transport import Transport, default_transport
+
 class Shutsuba(ABC):
     
     @abstractmethod
@@ -20,35 +32,143 @@ class Shutsuba(ABC):
 
 # get data from NKB
 # get odds from JRA
+# Pages are fetched and sections parsed on first access, each section (race_meta, horses, odds)
+# is parsed once. horses and odds are indexed by raceKey, the card by raceKey and horseNum. init=False fetches nothing, e.g. screening races on race_meta never downloads
+# the JRA odds page nor parses the horse table.
 class NKBJRAShutsuba(Shutsuba):
     
     def data(self):
       return self._data.query('not isCanceled').drop('isCanceled', axis=1).reset_index()
     
+    # history: number of odds snapshots kept in odds_history while polling
     def __init__(self, 
                  nkburl:str, 
-                 jraurl:str, init:bool = True) -> None:
-      self._data:pd.DataFrame = pd.DataFrame()
+                 jraurl:str, init:bool = True,
+                 transport:Transport|None = None,
+                 history:int = 720) -> None:
       self.nkburl = nkburl
       self.jraurl = jraurl
-      self.nkbsoup = self.__get_soup(nkburl)
-      self.jrasoup = self.__get_soup(jraurl)
+      self.transport = transport or default_transport()
+      self.odds_history:deque[pd.DataFrame] = deque(maxlen=history)
 
       if init:
         self.init()
     
+    # fetch and parse everything now instead of on first access
     def init(self):
-      horses = self.fetch_horse_info(self.nkbsoup)
-      horses = pd.merge(horses, self.fetch_odds(self.jrasoup), on='horseNum')
-      self._data = horses
+      self._data
+
+    @cached_property
+    def nkbsoup(self) -> BeautifulSoup:
+      return self.__get_soup(self.nkburl, URLKind.shutuba, HORSE_LIST)
+
+    @cached_property
+    def jrasoup(self) -> BeautifulSoup:
+      soup = self.__get_soup(self.jraurl, URLKind.odds, ODDS_TABLE)
+      self._odds_digest = self.__digest(soup)
+      self._odds_time = datetime.datetime.now()
+      return soup
+
+    # integer race key (abt.racekey) of the netkeiba url, -1 when the url has no race id
+    @cached_property
+    def race_key(self) -> int:
+      return int(racekey.from_url([self.nkburl])[0])
+
+    @cached_property
+    def race_meta(self) -> pd.DataFrame:
+      return self.__parse_race_meta(self.nkbsoup)
+
+    @cached_property
+    def horses(self) -> pd.DataFrame:
+      return racekey.keyed(self.fetch_horse_info(self.nkbsoup), self.race_key)
+
+    # latest odds, replaced by poll_odds when the table changes
+    @cached_property
+    def odds(self) -> pd.DataFrame:
+      return racekey.keyed(self.fetch_odds(self.jrasoup), self.race_key)
+
+    @cached_property
+    def _data(self) -> pd.DataFrame:
+      horses, odds = self.horses, self.odds
+      with span('build', table='shutsuba') as s:
+        data = pd.merge(horses.reset_index(), odds.reset_index(), on=['raceKey', 'horseNum'])
+        data = schema.apply(data, schema.SHUTSUBA).set_index(['raceKey', 'horseNum'])
+        s.field(rows=len(data))
+      return data
     
-    def __get_soup(self, url:str) -> BeautifulSoup:
-      res = requests.get(url) 
-      return BeautifulSoup(res.content, 'lxml') 
+    def __get_soup(self, url:str, kind:URLKind, parse_only:SoupStrainer) -> BeautifulSoup:
+      res = self.transport.get(url, kind=kind) 
+      return make_soup(res.content, parse_only=parse_only)
+
+    def __digest(self, soup:BeautifulSoup) -> str:
+      return hashlib.sha1(str(soup.find('tbody')).encode()).hexdigest()
+
+    def __snapshot(self, soup:BeautifulSoup, at:datetime.datetime) -> pd.DataFrame:
+      return racekey.keyed(self.fetch_odds(soup).assign(time=at), self.race_key)
+
+    # Re-fetch and re-parse the JRA odds table only
+    # returns the new snapshot with oddsChange/popularityChange against the previous one,
+    # None when the table is unchanged. Snapshots are appended to odds_history.
+    # With a CachedTransport the page is revalidated once the odds TTL has passed.
+    def poll_odds(self) -> pd.DataFrame|None:
+      if not self.odds_history:
+        soup = self.jrasoup
+        self.odds_history.append(self.__snapshot(soup, self._odds_time))
+      soup = self.__get_soup(self.jraurl, URLKind.odds, ODDS_TABLE)
+      digest = self.__digest(soup)
+      if digest == self._odds_digest:
+        return None
+      self.jrasoup = soup
+      self._odds_digest = digest
+      self._odds_time = datetime.datetime.now()
+
+      previous = self.odds_history[-1].set_index('horseNum')
+      odds = self.__snapshot(soup, self._odds_time)
+      odds['oddsChange'] = odds['odds'].to_numpy() - odds['horseNum'].map(previous['odds']).to_numpy()
+      odds['popularityChange'] = odds['popularity'].to_numpy() - odds['horseNum'].map(previous['popularity']).to_numpy()
+      self.odds_history.append(odds)
+      self.odds = odds[['horseNum', 'odds', 'popularity']]
+      # the card is merged again with the new odds on next access
+      self.__dict__.pop('_data', None)
+      return odds
+
+    # Poll the odds every interval seconds and yield each changed snapshot
+    # stops at until (datetime) or after count polls, runs forever when both are None
+    def stream_odds(self, 
+                    interval:float = 5, 
+                    until:datetime.datetime|None = None, 
+                    count:int|None = None) -> Iterator[pd.DataFrame]:
+      polls = 0
+      next_poll = time.monotonic()
+      while (until is None or datetime.datetime.now() < until) and (count is None or polls < count):
+        time.sleep(max(0, next_poll - time.monotonic()))
+        next_poll = time.monotonic() + interval
+        odds = self.poll_odds()
+        polls += 1
+        if odds is not None:
+          yield odds
+
+    async def astream_odds(self, 
+                           interval:float = 5, 
+                           until:datetime.datetime|None = None, 
+                           count:int|None = None) -> AsyncIterator[pd.DataFrame]:
+      polls = 0
+      next_poll = time.monotonic()
+      while (until is None or datetime.datetime.now() < until) and (count is None or polls < count):
+        await asyncio.sleep(max(0, next_poll - time.monotonic()))
+        next_poll = time.monotonic() + interval
+        odds = await asyncio.to_thread(self.poll_odds)
+        polls += 1
+        if odds is not None:
+          yield odds
 
     def fetch_race_meta(self) -> pd.DataFrame:
-        tag = self.nkbsoup.find('div', attrs={'class': 'RaceData01'})
-        tag2 =  self.nkbsoup.find('div', attrs={'class': 'RaceData02'})
+        return self.race_meta
+
+    @timed('parse', stage='meta')
+    def __parse_race_meta(self, soup:BeautifulSoup) -> pd.DataFrame:
+        tag = soup.find('div', attrs={'class': 'RaceData01'})
+        tag2 =  soup.find('div', attrs={'class': 'RaceData02'})
         if isinstance(tag, Tag) and isinstance(tag2, Tag):
             res=dict()
             def get_field_type(input, options):
@@ -79,77 +199,169 @@ class NKBJRAShutsuba(Shutsuba):
                     if any([x in val for x in field_options]):
                         res['field_type'] = get_field_type(val, field_options)
                         if len(re.findall(r'\d+', val)) == 1:
-                            res['distance'] = re.findall(r'\d+', val)
+                            res['distance'] = re.findall(r'\d+', val)[0]
                     if "障" in val:
                         res['distance'] = re.findall(r'\d+', val)[0]
                         res['is_hindrance'] = int(True)
-            return pd.DataFrame(res, index=[0])
+            return schema.apply(pd.DataFrame(res, index=[0]), schema.RACE_META)
         else:
             raise RuntimeError("can not find the right tag")
 
-  
-    def __get_weight(self, row_tag:Tag) -> dict:
-        tag = row_tag.find('td', class_='Weight')
-        if isinstance(tag, Tag):
-            weight = tag.get_text().lstrip().rstrip('\n')
-            try:
-                weightChange = int(weight[weight.find('(')+1:weight.find(')')].lstrip().rstrip('\n'))
-            except:
-                weightChange = np.nan
-            horseWeight = weight[:weight.find('(')]
-            sign = -1 if '-' in horseWeight else 1
-            try:
-                horseWeight = sign* int(re.findall(r'\d+', horseWeight)[0].lstrip().rstrip('\n'))
-            except:
-                horseWeight = np.nan
-            
-            return {'weight': horseWeight,'weightChange':weightChange}
-        else:
-            return {'weight': np.nan, 'weightChange':np.nan}
-
-    def __get_id_from_url(self, url:str) -> str:
-        if url.endswith('/'):
-            url = url[:-1]
-        return url.split("/")[-1]
-
-    def __get_age_sex(self, rowTag:Tag) -> dict:
-        tag = rowTag.find('td', class_='Barei Txt_C')
-        if isinstance(tag, Tag):
-          agesex = tag.get_text().lstrip().rstrip('\n')
-          return {'age':int(re.findall(r'\d+', agesex)[0]), 'sex':re.findall(r'[^\d]', agesex)[0]}
-        else:
-            return {'age': np.nan, 'sex':''}
 
+    @timed('parse', stage='horses')
     def fetch_horse_info(self, soup) -> pd.DataFrame:
-        tags = soup.find_all('tr', class_='HorseList')
-        rows = list()
-        for tag in tags:
-          info = dict()
-          info['horseNum'] = int(tag.select('td[class*="Umaban"]')[0].text.lstrip().rstrip('\n'))
-          info['lane'] = int(tag.select('td[class*="Waku"]')[0].find('span').text.lstrip().rstrip('\n'))
-          info['horseName'] = tag.find('span', 'HorseName').get_text().lstrip().rstrip('\n')
-          info['horseId'] = self.__get_id_from_url(tag.find('span', 'HorseName').find("a").get('href').lstrip().rstrip('\n'))
-          info['trainerName'] = tag.find('td', 'Trainer').find("a").text.lstrip().rstrip('\n')
-          info['affiliations'] = tag.find('td', 'Trainer').find('span').text.lstrip().rstrip('\n')
-          info['trainId'] = self.__get_id_from_url(tag.find('td', 'Trainer').find("a").get('href').lstrip().rstrip('\n'))
-          info['isCanceled'] = True if tag.find('td', class_='Cancel_Txt') else False
-          info = info|self.__get_weight(tag)
-          info = info|self.__get_age_sex(tag)
-          info['load'] = float(tag.select('td[class="Txt_C"]')[0].text) if tag.select('td[class="Txt_C"]') else np.nan
-          rows.append(info)
-        print(len(rows))
-        return pd.DataFrame(rows)
+        return schema.apply(pd.DataFrame(horse_rows(soup)), schema.SHUTSUBA)
 
+    @timed('parse', stage='odds')
     def fetch_odds(self, soup) -> pd.DataFrame:
-        tags = soup.find('tbody').find_all('tr')
-        rows = list()
-        for tag in tags:
-            info = dict()
-            horse_num = tag.find('td', class_='num').text.split('\n')[0]
-            odds = tag.find('div', class_='odds').find('span', class_='num').text
-            info['horseNum'] = int(horse_num) if horse_num.isnumeric() else np.nan
-            info['odds']= float(odds) if odds.replace('.', '').isnumeric() else np.nan
-            rows.append(info)
-        return pd.DataFrame(rows).pipe(
-                  lambda x: x.assign(popularity = x['odds'].rank().astype(int, errors = 'ignore')))
-            
+        return odds_frame(odds_rows(soup))
+
+# Row parsers shared by NKBJRAShutsuba and the fetch/parse pipeline
+# they only depend on the soup (or the raw page), so they can run in worker processes
+
+def _get_weight(row_tag:Tag) -> dict:
+    tag = row_tag.find('td', class_='Weight')
+    if isinstance(tag, Tag):
+        weight = tag.get_text().lstrip().rstrip('\n')
+        try:
+            weightChange = int(weight[weight.find('(')+1:weight.find(')')].lstrip().rstrip('\n'))
+        except:
+            weightChange = np.nan
+        horseWeight = weight[:weight.find('(')]
+        sign = -1 if '-' in horseWeight else 1
+        try:
+            horseWeight = sign* int(re.findall(r'\d+', horseWeight)[0].lstrip().rstrip('\n'))
+        except:
+            horseWeight = np.nan
+        
+        return {'weight': horseWeight,'weightChange':weightChange}
+    else:
+        return {'weight': np.nan, 'weightChange':np.nan}
+
+def _get_id_from_url(url:str) -> str:
+    if url.endswith('/'):
+        url = url[:-1]
+    return url.split("/")[-1]
+
+def _get_age_sex(rowTag:Tag) -> dict:
+    tag = rowTag.find('td', class_='Barei Txt_C')
+    if isinstance(tag, Tag):
+      agesex = tag.get_text().lstrip().rstrip('\n')
+      return {'age':int(re.findall(r'\d+', agesex)[0]), 'sex':re.findall(r'[^\d]', agesex)[0]}
+    else:
+        return {'age': np.nan, 'sex':''}
+
+def horse_rows(soup) -> list[dict]:
+    tags = soup.find_all('tr', class_='HorseList')
+    rows = list()
+    for tag in tags:
+      info = dict()
+      info['horseNum'] = int(tag.select('td[class*="Umaban"]')[0].text.lstrip().rstrip('\n'))
+      info['lane'] = int(tag.select('td[class*="Waku"]')[0].find('span').text.lstrip().rstrip('\n'))
+      info['horseName'] = tag.find('span', 'HorseName').get_text().lstrip().rstrip('\n')
+      info['horseId'] = _get_id_from_url(tag.find('span', 'HorseName').find("a").get('href').lstrip().rstrip('\n'))
+      info['trainerName'] = tag.find('td', 'Trainer').find("a").text.lstrip().rstrip('\n')
+      info['affiliations'] = tag.find('td', 'Trainer').find('span').text.lstrip().rstrip('\n')
+      info['trainId'] = _get_id_from_url(tag.find('td', 'Trainer').find("a").get('href').lstrip().rstrip('\n'))
+      info['isCanceled'] = True if tag.find('td', class_='Cancel_Txt') else False
+      info = info|_get_weight(tag)
+      info = info|_get_age_sex(tag)
+      info['load'] = float(tag.select('td[class="Txt_C"]')[0].text) if tag.select('td[class="Txt_C"]') else np.nan
+      rows.append(info)
+    return rows
+
+def odds_rows(soup) -> list[dict]:
+    tags = soup.find('tbody').find_all('tr')
+    rows = list()
+    for tag in tags:
+        info = dict()
+        horse_num = tag.find('td', class_='num').text.split('\n')[0]
+        odds = tag.find('div', class_='odds').find('span', class_='num').text
+        info['horseNum'] = int(horse_num) if horse_num.isnumeric() else np.nan
+        info['odds']= float(odds) if odds.replace('.', '').isnumeric() else np.nan
+        rows.append(info)
+    return rows
+
+# popularity is the odds rank within one race
+def odds_frame(rows:list[dict]) -> pd.DataFrame:
+    return pd.DataFrame(rows).pipe(
+              lambda x: x.assign(popularity = x['odds'].rank().astype(int, errors = 'ignore'))).pipe(
+              schema.apply, schema.SHUTSUBA)
+
+def parse_horses(content:bytes) -> list[dict]:
+    return horse_rows(make_soup(content, parse_only=HORSE_LIST))
+
+def parse_odds(content:bytes) -> list[dict]:
+    return odds_rows(make_soup(content, parse_only=ODDS_TABLE))
+
+# Build race cards for every race of a schedule at once
+# schedule: JRASchedule.data() or any frame with netkeibaURL (netkeiba shutuba) and url (JRA odds) columns
+# Horses are indexed by raceKey and horseNum, the race columns of the schedule are kept
+# Races that fail are kept in errors instead of aborting the whole card
+class NKBJRAShutsubaBatch(Shutsuba):
+
+    keys = ['date', 'location', 'round', 'day', 'race']
+
+    # empty when every race failed, see errors
+    def data(self):
+      if self._data.empty:
+        return pd.DataFrame()
+      return self._data.query('not isCanceled').drop('isCanceled', axis=1).reset_index()
+
+    def __init__(self,
+                 schedule:pd.DataFrame,
+                 init:bool = True,
+                 max_workers:int = 8,
+                 transport:Transport|None = None) -> None:
+      self._data:pd.DataFrame = pd.DataFrame()
+      self.schedule = schedule
+      self.max_workers = max_workers
+      self.transport = transport or default_transport()
+      self.errors:pd.DataFrame = pd.DataFrame()
+      if init:
+        self.init()
+
+    def init(self):
+      keys = [x for x in self.keys if x in self.schedule.columns]
+      races = self.schedule.to_dict('records')
+      results = map_concurrent(self.__load, races, self.max_workers)
+
+      frames = list()
+      errors = list()
+      race_keys = racekey.from_schedule(self.schedule)
+      for key, race, (horses, error) in zip(race_keys, races, results):
+        meta = {'raceKey':int(key)}|{k:race[k] for k in keys}
+        if error is not None:
+          errors.append(meta|{'netkeibaURL':race['netkeibaURL'], 'url':race['url'], 'error':repr(error)})
+        else:
+          frames.append(horses.assign(**meta))
+      self.errors = pd.DataFrame(errors)
+      if frames:
+        with span('build', table='shutsuba_batch') as s:
+          self._data = schema.apply(pd.concat(frames, ignore_index=True), schema.SHUTSUBA).set_index(['raceKey', 'horseNum'])
+          s.field(rows=len(self._data))
+
+    def __load(self, race:dict) -> tuple[pd.DataFrame|None, Exception|None]:
+      try:
+        shutsuba = NKBJRAShutsuba(race['netkeibaURL'], race['url'], transport=self.transport)
+        return shutsuba._data.reset_index(), None
+      except Exception as e:
+        return None, e
+
+# Poll the odds of several races together, every race is fetched concurrently on each tick
+# yields (race, snapshot) for the races whose odds changed
+def stream_odds(races:list[NKBJRAShutsuba],
+                interval:float = 5,
+                until:datetime.datetime|None = None,
+                count:int|None = None,
+                max_workers:int = 8) -> Iterator[tuple[NKBJRAShutsuba, pd.DataFrame]]:
+    polls = 0
+    next_poll = time.monotonic()
+    while (until is None or datetime.datetime.now() < until) and (count is None or polls < count):
+        time.sleep(max(0, next_poll - time.monotonic()))
+        next_poll = time.monotonic() + interval
+        snapshots = map_concurrent(lambda x: x.poll_odds(), races, max_workers)
+        polls += 1
+        for race, odds in zip(races, snapshots):
+            if odds is not None:
+                yield race, odds
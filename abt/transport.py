@@ -0,0 +1,114 @@
+import threading
+import requests
+from urllib.parse import urlparse
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from abc import ABC, abstractmethod
+
+from .const import URLKind
+from .instrument import span, enabled
+from .pool import HostLimiter, HostRateLimiter
+
+# guess the kind of page from its url, loaders pass the kind explicitly when they know better
+def classify_url(url:str) -> URLKind:
+    if 'db.netkeiba.com' in url and ('/horse/' in url or '/trainer/' in url):
+        return URLKind.profile
+    if 'netkeiba.com' in url:
+        if '/result.html' in url:
+            return URLKind.result
+        if '/shutuba.html' in url:
+            return URLKind.shutuba
+        if '/odds' in url:
+            return URLKind.odds
+    if 'jra.go.jp' in url:
+        if '/keiba/baba/' in url:
+            return URLKind.baba
+        if '/JRADB/' in url:
+            return URLKind.schedule
+    return URLKind.other
+
+class Transport(ABC):
+
+    @abstractmethod
+    def get(self, url:str, kind:URLKind|None = None, **kwargs) -> requests.Response:
+      pass
+
+    @abstractmethod
+    def post(self, url:str, data:dict|None = None, **kwargs) -> requests.Response:
+      pass
+
+    # drop any stored copy of url, no-op for transports without a cache
+    def invalidate(self, url:str) -> None:
+      pass
+
+    # GET that checks a stored copy of url with the server instead of trusting its lifetime,
+    # a plain get for transports without a cache
+    def revalidate(self, url:str, kind:URLKind|None = None, **kwargs) -> requests.Response:
+      return self.get(url, kind=kind, **kwargs)
+
+# requests based transport shared by all loaders
+# - one Session, so connections are pooled and kept alive per host
+# - retry with exponential backoff on connection errors and 429/5xx
+# - per_host: concurrent requests per host, rate: requests per second per host
+# - timeout: (connect, read) seconds
+class HTTPTransport(Transport):
+    def __init__(self,
+                 timeout:float|tuple[float, float] = (5, 30),
+                 retries:int = 3,
+                 backoff:float = 0.5,
+                 pool_size:int = 16,
+                 per_host:int = 4,
+                 rate:float|None = None,
+                 headers:dict|None = None) -> None:
+        self.timeout = timeout
+        self._limiter = HostLimiter(per_host)
+        self._rate = HostRateLimiter(rate)
+        retry = Retry(
+            total=retries,
+            backoff_factor=backoff,
+            status_forcelist=(429, 500, 502, 503, 504),
+            allowed_methods=frozenset(['GET', 'HEAD', 'POST']))
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+        self.session = requests.Session()
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        if headers:
+            self.session.headers.update(headers)
+
+    def request(self, method:str, url:str, kind:URLKind|None = None, **kwargs) -> requests.Response:
+        kwargs.setdefault('timeout', self.timeout)
+        with span('fetch', method=method) as s:
+            with self._limiter(url):
+                self._rate.wait(url)
+                res = self.session.request(method, url, **kwargs)
+            if enabled():
+                s.label(kind=(kind or classify_url(url)).name, host=urlparse(url).netloc, status=res.status_code)
+                s.field(bytes=len(res.content))
+        res.raise_for_status()
+        return res
+
+    def get(self, url:str, kind:URLKind|None = None, **kwargs) -> requests.Response:
+        return self.request('GET', url, kind=kind, **kwargs)
+
+    def post(self, url:str, data:dict|None = None, **kwargs) -> requests.Response:
+        return self.request('POST', url, data=data, **kwargs)
+
+    def close(self) -> None:
+        self.session.close()
+
+_default:Transport|None = None
+_default_lock = threading.Lock()
+
+# process wide transport used when a loader is built without one
+def default_transport() -> Transport:
+    global _default
+    with _default_lock:
+        if _default is None:
+            _default = HTTPTransport()
+        return _default
+
+def set_default_transport(transport:Transport) -> None:
+    global _default
+    with _default_lock:
+        _default = transport
@@ -0,0 +1,51 @@
+# Cold start cost of importing abt and each loader
+# usage: python benchmarks/import_time.py [--repeat 5]
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+
+TARGETS = {
+    'abt': 'import abt',
+    'JRAGroundCondition': 'from abt import JRAGroundCondition',
+    'NKBResult': 'from abt import NKBResult',
+    'NKBJRAShutsuba': 'from abt import NKBJRAShutsuba',
+    'JRASchedule': 'from abt import JRASchedule',
+}
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# run the statement in a fresh interpreter with -X importtime and sum the cumulative
+# time of the top level imports it triggered (microseconds)
+def measure(statement:str) -> tuple[int, list[str]]:
+    res = subprocess.run([sys.executable, '-X', 'importtime', '-c', statement],
+                         cwd=ROOT, capture_output=True, text=True, check=True)
+    total = 0
+    modules = list()
+    for line in res.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = [x.strip() for x in line[len('import time:'):].split('|')]
+        # top level imports are not indented
+        if name == name.lstrip():
+            total += int(cumulative)
+            modules.append(name)
+    return total, modules
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+    # interpreter start up (site, encodings, ...) is measured once and subtracted
+    baseline = statistics.median([measure('pass')[0] for _ in range(args.repeat)])
+    print(f"{'target':<22}{'median ms':>12}{'min ms':>10}  third party")
+    for name, statement in TARGETS.items():
+        runs = [measure(statement) for _ in range(args.repeat)]
+        times = [max(0, x[0] - baseline)/1000 for x in runs]
+        third_party = sorted({x.split('.')[0] for x in runs[0][1]} &
+                             {'pandas', 'numpy', 'bs4', 'requests', 'lxml', 'selenium', 'webdriver_manager', 'tqdm'})
+        print(f"{name:<22}{statistics.median(times):>12.1f}{min(times):>10.1f}  {','.join(third_party)}")
+
+if __name__ == '__main__':
+    main()
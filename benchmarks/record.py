@@ -0,0 +1,37 @@
+# Record this week's JRA / netkeiba pages into a fixture directory for the offline benchmarks
+# usage: python benchmarks/record.py [--dir benchmarks/fixtures] [--races 12]
+import argparse
+import json
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from abt import JRASchedule, NKBJRAShutsuba, NKBResult, JRAGroundCondition
+from fixtures import DEFAULT_DIR, RecordingTransport
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--dir', default=DEFAULT_DIR)
+    parser.add_argument('--races', type=int, default=12, help='number of race cards and results to record')
+    args = parser.parse_args()
+
+    transport = RecordingTransport(args.dir)
+    schedule = JRASchedule(transport=transport, browser=False)
+    data = schedule.data()
+    for race in data.head(args.races).itertuples():
+        NKBJRAShutsuba(race.netkeibaURL, race.url, transport=transport)
+        try:
+            NKBResult(race.resultURL, transport=transport)
+        except Exception as e:
+            print(f'no result for {race.resultURL}: {e!r}')
+    for location in data['location'].unique():
+        JRAGroundCondition(location, transport=transport)
+    # races recorded, run.py rebuilds the loaders from these urls
+    races = data.head(args.races)[['location', 'netkeibaURL', 'url', 'resultURL']].to_dict('records')
+    with open(os.path.join(args.dir, 'races.json'), 'w', encoding='utf-8') as f:
+        json.dump(races, f, ensure_ascii=False, indent=1)
+    print(f'recorded {len(transport.manifest)} pages into {args.dir}')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,187 @@
+# Offline benchmarks of the loaders against recorded pages
+# usage: python benchmarks/run.py [--dir benchmarks/fixtures] [--latency 0.05] [--repeat 3] [--parity]
+#
+# parse:   time to build the soup and extract the rows for every recorded page, per page kind
+# loaders: end-to-end wall time and peak python memory (tracemalloc) of each loader, served by a
+#          local HTTP server that answers after --latency seconds
+# parity:  frames of each loader with the default strained lxml parse against a full html5lib
+#          parse (abt.parser.set_backend), differences are printed and the exit status is 1.
+#          --parity runs this check only, over the committed fixtures it takes a few seconds
+# benchmarks/fixtures holds a small synthetic week (2 meetings of 3 races) so that the suite runs
+# offline, benchmarks/record.py records the live pages of this week into --dir instead
+import argparse
+import json
+import os
+import statistics
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pandas as pd
+
+from abt import JRASchedule, NKBJRAShutsuba, NKBResult, JRAGroundCondition
+from abt.parser import get_backend, make_soup, set_backend, HORSE_LIST, ODDS_TABLE, RACE_TIME, RESULT_TABLES
+from fixtures import DEFAULT_DIR, FixtureServer, LocalTransport, load_manifest
+
+# parsed only, the loaders are not constructed
+_shutsuba = NKBJRAShutsuba.__new__(NKBJRAShutsuba)
+_result = NKBResult.__new__(NKBResult)
+
+def parse_shutuba(content:bytes):
+    # new object per page, race_meta is memoized per object
+    shutsuba = NKBJRAShutsuba.__new__(NKBJRAShutsuba)
+    shutsuba.nkbsoup = make_soup(content, parse_only=HORSE_LIST)
+    shutsuba.horses
+    shutsuba.race_meta
+
+PARSERS = {
+    'shutuba': parse_shutuba,
+    'odds': lambda x: _shutsuba.fetch_odds(make_soup(x, parse_only=ODDS_TABLE)),
+    'result': lambda x: _result.get_result(make_soup(x, parse_only=RESULT_TABLES)),
+    'schedule': lambda x: make_soup(x, parse_only=RACE_TIME),
+    'baba': lambda x: make_soup(x),
+}
+
+def bench_parse(directory:str, manifest:dict, repeat:int) -> list[dict]:
+    pages:dict[str, list[bytes]] = dict()
+    for entry in manifest.values():
+        with open(os.path.join(directory, entry['file']), 'rb') as f:
+            pages.setdefault(entry['kind'], list()).append(f.read())
+    rows = list()
+    for kind, contents in sorted(pages.items()):
+        if kind not in PARSERS:
+            continue
+        times = list()
+        for content in contents:
+            for _ in range(repeat):
+                started = time.perf_counter()
+                try:
+                    PARSERS[kind](content)
+                except Exception:
+                    # navigation pages recorded under the schedule kind have no race table
+                    pass
+                times.append(time.perf_counter() - started)
+        rows.append({'name': kind, 'pages': len(contents), 'ms/page': 1000*statistics.mean(times),
+                     'KB/page': sum(len(x) for x in contents)/len(contents)/1024})
+    return rows
+
+def measure(func, repeat:int) -> dict:
+    times = list()
+    peaks = list()
+    for _ in range(repeat):
+        tracemalloc.start()
+        started = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - started)
+        peaks.append(tracemalloc.get_traced_memory()[1])
+        tracemalloc.stop()
+    return {'wall s': statistics.median(times), 'peak MB': max(peaks)/1024/1024}
+
+def bench_loaders(server:FixtureServer, races:list[dict], manifest:dict, repeat:int) -> list[dict]:
+    cases = dict()
+    if any(x.startswith('POST ') for x in manifest):
+        cases['JRASchedule.init'] = lambda t: JRASchedule(transport=t, browser=False)
+    if races:
+        cases['NKBJRAShutsuba'] = lambda t: [NKBJRAShutsuba(x['netkeibaURL'], x['url'], transport=t) for x in races]
+        def results(t):
+            for race in races:
+                NKBResult(race['resultURL'], transport=t).payouts
+        cases['NKBResult.payouts'] = results
+        locations = sorted({x['location'] for x in races})
+        cases['JRAGroundCondition.init'] = lambda t: [JRAGroundCondition(x, transport=t) for x in locations]
+    rows = list()
+    for name, case in cases.items():
+        # new transport per case so that no connection is reused across cases
+        try:
+            rows.append({'name': name} | measure(lambda: case(LocalTransport(server)), repeat))
+        except Exception as e:
+            tracemalloc.stop()
+            print(f'{name} failed: {e!r}')
+    return rows
+
+# loader output frames compared by bench_parity
+def parity_cases(races:list[dict], manifest:dict) -> dict:
+    cases = dict()
+    if any(x.startswith('POST ') for x in manifest):
+        cases['JRASchedule'] = lambda t: JRASchedule(transport=t, browser=False).data()
+    if races:
+        cases['NKBJRAShutsuba'] = lambda t: pd.concat(
+            [NKBJRAShutsuba(x['netkeibaURL'], x['url'], transport=t).data() for x in races])
+        cases['NKBJRAShutsuba.race_meta'] = lambda t: pd.concat(
+            [NKBJRAShutsuba(x['netkeibaURL'], x['url'], init=False, transport=t).race_meta for x in races])
+        cases['NKBResult.payouts'] = lambda t: pd.concat(
+            [NKBResult(x['resultURL'], transport=t).payouts for x in races])
+        cases['NKBResult.ranking'] = lambda t: pd.concat(
+            [NKBResult(x['resultURL'], transport=t).ranking for x in races])
+        locations = sorted({x['location'] for x in races})
+        cases['JRAGroundCondition'] = lambda t: pd.concat(
+            [JRAGroundCondition(x, transport=t).to_df() for x in locations])
+    return cases
+
+def bench_parity(server:FixtureServer, races:list[dict], manifest:dict) -> tuple[list[dict], dict[str, str]]:
+    rows = list()
+    differences = dict()
+    backend = get_backend()
+    for name, case in parity_cases(races, manifest).items():
+        try:
+            set_backend(None)
+            strained = case(LocalTransport(server))
+            set_backend('html5lib')
+            full = case(LocalTransport(server))
+        except Exception as e:
+            # a loader that fails with one of the backends is a difference as well
+            differences[name] = f'failed with backend {get_backend() or "lxml"}: {e!r}'
+            rows.append({'name': name, 'rows': 0, 'identical': 'no'})
+            continue
+        finally:
+            set_backend(backend)
+        try:
+            pd.testing.assert_frame_equal(strained, full)
+        except AssertionError as e:
+            differences[name] = str(e)
+        rows.append({'name': name, 'rows': len(strained), 'identical': 'no' if name in differences else 'yes'})
+    return rows, differences
+
+def show(title:str, rows:list[dict]) -> None:
+    print(f'\n{title}')
+    if not rows:
+        print('  (no fixtures)')
+        return
+    cols = list(rows[0])
+    print('  ' + ''.join(f'{x:>14}' if i else f'{x:<26}' for i, x in enumerate(cols)))
+    for row in rows:
+        print('  ' + ''.join(f'{row[x]:<26}' if not i else
+                             f'{row[x]:>14.2f}' if isinstance(row[x], float) else f'{row[x]:>14}'
+                             for i, x in enumerate(cols)))
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--dir', default=DEFAULT_DIR)
+    parser.add_argument('--latency', type=float, default=0.05, help='seconds before the local server answers')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--parity', action='store_true', help='only compare the lxml and html5lib frames')
+    args = parser.parse_args()
+
+    if not os.path.exists(os.path.join(args.dir, 'manifest.json')):
+        print(f'No fixtures in {args.dir} (manifest.json is missing), record them with benchmarks/record.py --dir {args.dir}')
+        sys.exit(1)
+    manifest = load_manifest(args.dir)
+    races_path = os.path.join(args.dir, 'races.json')
+    races = json.load(open(races_path, encoding='utf-8')) if os.path.exists(races_path) else list()
+
+    if not args.parity:
+        show('parse (per page)', bench_parse(args.dir, manifest, args.repeat))
+        with FixtureServer(args.dir, latency=args.latency) as server:
+            show(f'loaders (latency {args.latency}s)', bench_loaders(server, races, manifest, args.repeat))
+    with FixtureServer(args.dir) as server:
+        rows, differences = bench_parity(server, races, manifest)
+    show('parity (strained lxml vs html5lib)', rows)
+    for name, difference in differences.items():
+        print(f'\n{name} differs:\n{difference}')
+    if differences:
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()